@@ -1,13 +1,16 @@
-import csv
-from io import StringIO
 from fastapi import APIRouter, Depends, Form, Request, UploadFile, File
 from fastapi.templating import Jinja2Templates
-from passlib.context import CryptContext
+from auth import AuthHandler
+import db
 import models
-import re
-from mongoengine.queryset.visitor import Q
+import prediction_worker
+import request_context
+from request_context import RequestContext
+import sales_import
+from ingredients import compute_requirements
+import validators
 from datetime import datetime
-from fastapi.responses import RedirectResponse, Response
+from fastapi.responses import JSONResponse, RedirectResponse, Response
 from fastapi_jwt_auth import AuthJWT
 from schemas import Settings
 from bson import ObjectId
@@ -16,15 +19,7 @@ from datetime import date
 templates = Jinja2Templates(directory="html")
 router = APIRouter(prefix="/api")
 
-pwd_context = CryptContext(schemes=['bcrypt'], deprecated='auto')
-
-
-def get_password_hash(password):
-    return pwd_context.hash(password)
-
-
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+auth_handler = AuthHandler()
 
 
 @AuthJWT.load_config
@@ -32,6 +27,12 @@ def get_config():
     return Settings()
 
 
+def form_errors(page, errors, test):
+    if test:
+        return JSONResponse({"errors": errors}, status_code=400)
+    return RedirectResponse(f"{page}?error={','.join(errors)}", status_code=302)
+
+
 @router.post("/register")
 async def register(first_name: str = Form(None),
     last_name: str = Form(None),
@@ -43,43 +44,22 @@ async def register(first_name: str = Form(None),
     test: bool = Form(False),
     authorize: AuthJWT = Depends()):
 
-    if not (first_name and last_name and email and password and password2 and phone and location):
-        if test:
-            return Response(status_code=400)
-        return RedirectResponse("/register?error=empty", status_code=302)
-
-    if password != password2:
-        if test:
-            return Response(status_code=400)
-        return RedirectResponse("/register?error=match", status_code=302)
-
-    if models.User.objects(Q(email=email)):
-        if test:
-            return Response(status_code=400)
-        return RedirectResponse("/register?error=email", status_code=302)
-    if not re.fullmatch("0?5\d{8}", phone):
-        if test:
-            return Response(status_code=400)
-        return RedirectResponse("/register?error=phone", status_code=302)
-    if not re.fullmatch("[A-Za-z0-9@#$%^&+=]{8,16}", password):
-        if test:
-            return Response(status_code=400)
-        return RedirectResponse("/register?error=password", status_code=302)
-    if not re.fullmatch("(\w|-)+@\w+\.[a-zA-Z]{2,3}", email):
-        if test:
-            return Response(status_code=400)
-        return RedirectResponse("/register?error=email", status_code=302)
+    errors = validators.validate_account(first_name, last_name, email, password, password2, phone, location)
+    # only a well-formed submission costs a database round trip
+    if not errors and await db.email_exists(email):
+        errors.append("email")
+    if errors:
+        return form_errors("/register", errors, test)
 
     user = models.User(first_name=first_name, last_name=last_name,email=email,
-                       password=get_password_hash(password),
+                       password=await auth_handler.hash_password(password),
                        phone=phone, type="restaurant", created_at=datetime.utcnow())
-    user.save()
+    await db.save(user)
 
     restaurant = models.Restaurant(user_id=user.id, location=location, menu=[])
-    restaurant.save()
+    await db.save(restaurant)
 
-    orders = models.Orders(user_id=user.id, orders=[])
-    orders.save()
+    await db.create_orders(user.id)
 
     access_token = authorize.create_access_token(subject=str(user.id))
 
@@ -96,18 +76,23 @@ async def login(email: str = Form(None), password : str = Form(None), test: bool
     if not email or not password:
         pass
 
-    user = models.User.objects(Q(email=email))
-    if not user:
+    user = await db.find_user(email)
+    if user is None:
         if test:
             return Response(status_code=400)
         return RedirectResponse("../login?error=email", status_code=302)
-    user = user[0]
 
-    if not verify_password(password, user.password):
+    valid, new_hash = await auth_handler.check_password(password, user.password)
+    if not valid:
         if test:
             return Response(status_code=401)
         return RedirectResponse("../login?error=password", status_code=302)
 
+    if new_hash:
+        user.password = new_hash
+        await db.save(user)
+        request_context.invalidate(str(user.id))
+
     access_token = authorize.create_access_token(subject=str(user.id))
 
     response = RedirectResponse("/", status_code=302)
@@ -128,17 +113,17 @@ async def logout(authorize: AuthJWT = Depends()):
     return response
 
 @router.post("/add_element")
-async def add_element(element_id: str = Form(None), name: str = Form(None), test: bool = Form(False), authorize: AuthJWT = Depends()):
-    authorize.jwt_required()
-    user_id = ObjectId(authorize.get_jwt_subject())
-    restaurant = models.Restaurant.objects.get(user_id=user_id)
+async def add_element(element_id: str = Form(None), name: str = Form(None), test: bool = Form(False), ctx: RequestContext = Depends()):
+    restaurant = await ctx.restaurant()
 
     if not (element_id and name):
         if test:
             return Response(status_code=400)
         return RedirectResponse("/menu", status_code=302)
 
-    if not restaurant.add_element(element_id, name) and test:
+    changed = await db.run(restaurant.add_element, element_id, name)
+    ctx.invalidate()
+    if not changed and test:
         return Response(status_code=400)
 
     if test:
@@ -148,17 +133,17 @@ async def add_element(element_id: str = Form(None), name: str = Form(None), test
 
 @router.post("/edit_element")
 async def edit_element(element_id_before: str = Form(None) ,element_id: str = Form(None), name: str = Form(None),
-                       test: bool = Form(False), authorize: AuthJWT = Depends()):
-    authorize.jwt_required()
-    user_id = ObjectId(authorize.get_jwt_subject())
-    restaurant = models.Restaurant.objects.get(user_id=user_id)
+                       test: bool = Form(False), ctx: RequestContext = Depends()):
+    restaurant = await ctx.restaurant()
 
     if not (element_id and name):
         if test:
             return Response(status_code=400)
         return RedirectResponse("../menu", status_code=302)
 
-    if not restaurant.modify_element(element_id_before, element_id, name) and test:
+    changed = await db.run(restaurant.modify_element, element_id_before, element_id, name)
+    ctx.invalidate()
+    if not changed and test:
         return Response(status_code=400)
 
     if test:
@@ -167,10 +152,8 @@ async def edit_element(element_id_before: str = Form(None) ,element_id: str = Fo
 
 
 @router.post("/remove_element")
-async def remove_element(element_id: str = Form(None), test: bool = Form(False), authorize: AuthJWT = Depends()):
-    authorize.jwt_required()
-    user_id = ObjectId(authorize.get_jwt_subject())
-    restaurant = models.Restaurant.objects.get(user_id=user_id)
+async def remove_element(element_id: str = Form(None), test: bool = Form(False), ctx: RequestContext = Depends()):
+    restaurant = await ctx.restaurant()
 
     if not element_id:
         if test:
@@ -178,7 +161,9 @@ async def remove_element(element_id: str = Form(None), test: bool = Form(False),
 
         RedirectResponse("/menu")
 
-    if not restaurant.remove_element(element_id) and test:
+    changed = await db.run(restaurant.remove_element, element_id)
+    ctx.invalidate()
+    if not changed and test:
         return Response(status_code=400)
 
     if test:
@@ -186,10 +171,8 @@ async def remove_element(element_id: str = Form(None), test: bool = Form(False),
     return RedirectResponse(f"../menu", status_code=302)
 
 @router.post("/add_ingredient")
-async def add_ingredient(element_id: str = Form(None), name: str = Form(None), quantity= Form(None), unit: str = Form(None), test: bool = Form(False), authorize: AuthJWT = Depends()):
-    authorize.jwt_required()
-    user_id = ObjectId(authorize.get_jwt_subject())
-    restaurant = models.Restaurant.objects.get(user_id=user_id)
+async def add_ingredient(element_id: str = Form(None), name: str = Form(None), quantity= Form(None), unit: str = Form(None), test: bool = Form(False), ctx: RequestContext = Depends()):
+    restaurant = await ctx.restaurant()
 
     if not (quantity and name and unit):
         if test:
@@ -206,7 +189,9 @@ async def add_ingredient(element_id: str = Form(None), name: str = Form(None), q
             if test:
                 return Response(status_code=400)
             return RedirectResponse(f"../menu/edit?element_id={element_id}", status_code=302)
-    if not restaurant.add_ingredient(element_id, name, quantity, unit) and test:
+    changed = await db.run(restaurant.add_ingredient, element_id, name, quantity, unit)
+    ctx.invalidate()
+    if not changed and test:
         return Response(status_code=400)
 
     if test:
@@ -216,10 +201,8 @@ async def add_ingredient(element_id: str = Form(None), name: str = Form(None), q
 
 @router.post("/edit_ingredient")
 async def edit_ingredient(element_id: str = Form(None), number: int = Form(None), test: bool = Form(False),
-                   name: str = Form(None), quantity = Form(None), unit: str = Form(None), authorize: AuthJWT = Depends()):
-    authorize.jwt_required()
-    user_id = ObjectId(authorize.get_jwt_subject())
-    restaurant = models.Restaurant.objects.get(user_id=user_id)
+                   name: str = Form(None), quantity = Form(None), unit: str = Form(None), ctx: RequestContext = Depends()):
+    restaurant = await ctx.restaurant()
 
     if quantity:
         try:
@@ -236,7 +219,9 @@ async def edit_ingredient(element_id: str = Form(None), number: int = Form(None)
             return Response(status_code=400)
         return RedirectResponse("/menu", status_code=302)
 
-    if not  restaurant.modify_ingredient(element_id, number, name, quantity, unit) and test:
+    changed = await db.run(restaurant.modify_ingredient, element_id, number, name, quantity, unit)
+    ctx.invalidate()
+    if not changed and test:
         return Response(status_code=400)
 
     if test:
@@ -245,17 +230,17 @@ async def edit_ingredient(element_id: str = Form(None), number: int = Form(None)
 
 
 @router.post("/remove_ingredient")
-async def remove_ingredient(element_id: str = Form(None), number: int = Form(None), test: bool = Form(False), authorize: AuthJWT = Depends()):
-    authorize.jwt_required()
-    user_id = ObjectId(authorize.get_jwt_subject())
-    restaurant = models.Restaurant.objects.get(user_id=user_id)
+async def remove_ingredient(element_id: str = Form(None), number: int = Form(None), test: bool = Form(False), ctx: RequestContext = Depends()):
+    restaurant = await ctx.restaurant()
 
     if not element_id:
         if test:
             return Response(status_code=400)
         return RedirectResponse("/menu", status_code=302)
 
-    if not restaurant.remove_ingredient(element_id, number) and test:
+    changed = await db.run(restaurant.remove_ingredient, element_id, number)
+    ctx.invalidate()
+    if not changed and test:
         return Response(status_code=400)
 
     if test:
@@ -266,10 +251,8 @@ async def remove_ingredient(element_id: str = Form(None), number: int = Form(Non
 
 @router.post("/add_charity")
 async def add_charity(name: str = Form(None), phone: str = Form(None), location: str = Form(None),
-                url: str = Form(None), test: bool = Form(False), authorize: AuthJWT = Depends()):
-    authorize.jwt_required()
-    user_id = ObjectId(authorize.get_jwt_subject())
-    user = models.User.objects.get(id=user_id)
+                url: str = Form(None), test: bool = Form(False), ctx: RequestContext = Depends()):
+    user = await ctx.user()
     if not user.is_admin():
         if test:
             return Response(status_code=401)
@@ -282,7 +265,7 @@ async def add_charity(name: str = Form(None), phone: str = Form(None), location:
 
     charity = models.Charity(name=name, phone=phone, location=location, location_url=url)
 
-    charity.save()
+    await db.save(charity)
 
     if test:
         return Response('{ \"id\" : \"' + str(charity.id) + "\" }", status_code=200)
@@ -291,10 +274,8 @@ async def add_charity(name: str = Form(None), phone: str = Form(None), location:
 
 @router.post("/edit_charity")
 async def edit_charity(id:str = Form(None), name: str = Form(None), phone: str = Form(None), location: str = Form(None),
-                url: str = Form(None), test: bool = Form(False), authorize: AuthJWT = Depends()):
-    authorize.jwt_required()
-    user_id = ObjectId(authorize.get_jwt_subject())
-    user = models.User.objects.get(id=user_id)
+                url: str = Form(None), test: bool = Form(False), ctx: RequestContext = Depends()):
+    user = await ctx.user()
     if not user.is_admin():
         if test:
             return Response(status_code=401)
@@ -305,13 +286,13 @@ async def edit_charity(id:str = Form(None), name: str = Form(None), phone: str =
             return Response(status_code=400)
         return RedirectResponse("/")
     try:
-        charity = models.Charity.objects.get(id=ObjectId(id))
+        charity = await db.get_charity(id)
 
         charity.name = name
         charity.phone = phone
         charity.location = location
         charity.location_url = url
-        charity.save()
+        await db.save(charity)
     except:
         if test:
             return Response(status_code=400)
@@ -322,10 +303,8 @@ async def edit_charity(id:str = Form(None), name: str = Form(None), phone: str =
 
 
 @router.post("/remove_charity")
-async def remove_charity(id:str = Form(None), test: bool = Form(False), authorize: AuthJWT = Depends()):
-    authorize.jwt_required()
-    user_id = ObjectId(authorize.get_jwt_subject())
-    user = models.User.objects.get(id=user_id)
+async def remove_charity(id:str = Form(None), test: bool = Form(False), ctx: RequestContext = Depends()):
+    user = await ctx.user()
     if not user.is_admin():
         if test:
             return Response(status_code=401)
@@ -337,9 +316,7 @@ async def remove_charity(id:str = Form(None), test: bool = Form(False), authoriz
         return RedirectResponse("../")
 
     try:
-        charity = models.Charity.objects(id=ObjectId(id))
-
-        charity.delete()
+        await db.delete_charity(id)
     except:
         if test:
             return Response(status_code=400)
@@ -349,9 +326,7 @@ async def remove_charity(id:str = Form(None), test: bool = Form(False), authoriz
     return RedirectResponse("/", status_code=302)
 
 @router.post("/add_sale")
-async def add_sale(time: date = Form(None), element_id: str = Form(None), quantity= Form(None), test: bool = Form(False), authorize: AuthJWT = Depends()):
-    authorize.jwt_required()
-    user_id = ObjectId(authorize.get_jwt_subject())
+async def add_sale(time: date = Form(None), element_id: str = Form(None), quantity= Form(None), test: bool = Form(False), ctx: RequestContext = Depends()):
     if quantity:
         try:
             quantity = float(quantity)
@@ -363,8 +338,9 @@ async def add_sale(time: date = Form(None), element_id: str = Form(None), quanti
     if not (time and element_id and quantity) and test:
         return Response(status_code=400)
 
-    orders = models.Orders.objects.get(user_id=user_id)
-    if not orders.add_sale_to_order(time, element_id, quantity) and test:
+    # the write is one atomic update, so the order history is not loaded
+    orders = await ctx.orders(history=False)
+    if not await db.run(orders.add_sale_to_order, time, element_id, quantity) and test:
         return Response(status_code=400)
 
     if test:
@@ -372,8 +348,7 @@ async def add_sale(time: date = Form(None), element_id: str = Form(None), quanti
     return RedirectResponse(f"../sales?time={time}", status_code=302)
 
 @router.post("/edit_sale")
-async def edit_sale(time: date = Form(None), element_id: str = Form(None), quantity = Form(None), test: bool = Form(False), authorize: AuthJWT = Depends()):
-    authorize.jwt_required()
+async def edit_sale(time: date = Form(None), element_id: str = Form(None), quantity = Form(None), test: bool = Form(False), ctx: RequestContext = Depends()):
 
     if quantity:
         try:
@@ -383,12 +358,8 @@ async def edit_sale(time: date = Form(None), element_id: str = Form(None), quant
                 return Response(status_code=400)
             RedirectResponse(f"../edit_sale?time={time}&element_id={element_id}", status_code=302)
 
-    user_id = ObjectId(authorize.get_jwt_subject())
-    orders = models.Orders.objects.get(user_id=user_id)
-    order = orders.get_order(time)
-    if order and order.modify_sale(element_id, quantity):
-        orders.save()
-    elif test:
+    orders = await ctx.orders(history=False)
+    if not await db.run(orders.modify_order, time, element_id, quantity) and test:
         return Response(status_code=400)
 
 
@@ -397,11 +368,9 @@ async def edit_sale(time: date = Form(None), element_id: str = Form(None), quant
     return RedirectResponse(f"../sales?time={time}", status_code=302)
 
 @router.post("/remove_sale")
-async def remove_sale(time: date = Form(None), element_id: str = Form(None), test: bool = Form(False), authorize: AuthJWT = Depends()):
-    authorize.jwt_required()
-    user_id = ObjectId(authorize.get_jwt_subject())
-    orders = models.Orders.objects.get(user_id=user_id)
-    if not orders.remove_sale_from_order(time, element_id) and test:
+async def remove_sale(time: date = Form(None), element_id: str = Form(None), test: bool = Form(False), ctx: RequestContext = Depends()):
+    orders = await ctx.orders(history=False)
+    if not await db.run(orders.remove_sale_from_order, time, element_id) and test:
         return Response(status_code=400)
 
     if test:
@@ -417,48 +386,22 @@ async def update_settings(first_name: str = Form(None),
     phone: str = Form(None),
     location: str = Form(None),
     test: bool = Form(False),
-    authorize: AuthJWT = Depends()):
-
-    authorize.jwt_required()
-
-    user_id = authorize.get_jwt_subject()
+    ctx: RequestContext = Depends()):
 
     try:
-        user = models.User.objects.get(id=user_id)
-        restaurant = models.Restaurant.objects.get(user_id=ObjectId(user_id))
+        user = await ctx.user()
+        restaurant = await ctx.restaurant()
     except Exception as e:
         if test:
             return Response(status_code=400)
         return RedirectResponse("../", status_code=302)
 
-    if not (first_name and last_name and email and phone and location and phone and (not ((password and not password2) or (not password and password2)))):
-        if test:
-            return Response(status_code=400)
-        return RedirectResponse("../settings?error=empty", status_code=302)
-
-    if password and password2 and password != password2:
-        if test:
-            return Response(status_code=400)
-        return RedirectResponse("../settings?error=match", status_code=302)
-
-    if email != user.email and models.User.objects(Q(email=email)):
-        if test:
-            return Response(status_code=400)
-        return RedirectResponse("/settings?error=email", status_code=302)
-
-    if not re.fullmatch("0?5\d{8}", phone):
-        if test:
-            return Response(status_code=400)
-        return RedirectResponse("/settings?error=phone", status_code=302)
-
-    if password and not re.fullmatch("[A-Za-z0-9@#$%^&+=]{8,16}", password):
-        if test:
-            return Response(status_code=400)
-        return RedirectResponse("/settings?error=password", status_code=302)
-    if not re.fullmatch("(\w|-)+@\w+\.[a-zA-Z]{2,3}", email):
-        if test:
-            return Response(status_code=400)
-        return RedirectResponse("/register?error=email", status_code=302)
+    errors = validators.validate_account(first_name, last_name, email, password, password2, phone, location,
+                                         password_required=False)
+    if not errors and email != user.email and await db.email_exists(email):
+        errors.append("email")
+    if errors:
+        return form_errors("/settings", errors, test)
 
     user.first_name = first_name
     user.last_name = last_name
@@ -466,51 +409,107 @@ async def update_settings(first_name: str = Form(None),
     user.phone = phone
     restaurant.location = location
     if password:
-        user.password = get_password_hash(password)
-    user.save()
-    restaurant.save()
+        user.password = await auth_handler.hash_password(password)
+    try:
+        await db.save(user)
+        await db.save(restaurant)
+    finally:
+        # even a failed save may have stored the user already
+        ctx.invalidate()
 
     if test:
         return Response(status_code=200)
     return RedirectResponse("../settings", status_code=302)
 
 @router.post("/upload")
-async def upload_file(file: UploadFile = File(), test: bool = Form(False),  authorize: AuthJWT = Depends()):
-    authorize.jwt_required()
+async def upload_file(file: UploadFile = File(), test: bool = Form(False),  ctx: RequestContext = Depends()):
     try:
-        orders = models.Orders.objects.get(user_id=ObjectId(authorize.get_jwt_subject()))
-
-        content = file.file.read()
-
-        buffer = StringIO(content.decode("utf-8"))
-
-        csv_reader = csv.reader(buffer)
-        for row in csv_reader:
-            element_id, quantity, time = row[:3]
-            orders.add_or_update_sale_to_order(datetime.strptime(time, "%m/%d/%Y").date(), element_id, float(quantity))
-        orders.save()
+        orders = await ctx.orders()
+        result = await db.run(sales_import.import_sales, orders, file.file)
     except Exception as e:
         if test:
             return Response(status_code=400)
         return RedirectResponse("/upload?error=file", status_code=302)
 
+    if result.failed:
+        if test:
+            return JSONResponse({"imported": result.imported, "failed": result.failed, "errors": result.errors},
+                                status_code=400)
+        return RedirectResponse(f"/upload?error=rows&imported={result.imported}&failed={result.failed}",
+                                status_code=302)
+
     if test:
         return Response(status_code=200)
     return RedirectResponse("/upload", status_code=302)
 
 
-@router.post("/predict")
-async def predict(authorize: AuthJWT = Depends()):
-    authorize.jwt_required()
-    user_id = ObjectId(authorize.get_jwt_subject())
+@router.get("/top_sales")
+async def top_sales(n: int = 5, days: int = 7, ctx: RequestContext = Depends()):
+    if not (0 < n <= 100 and 0 < days <= 366):
+        return Response(status_code=400)
+
+    orders = await ctx.orders(history=False)
+    labels, sales = await db.run(orders.get_most_sales_in_week, n, days)
+    return {"labels": labels, "sales": sales}
+
+
+@router.get("/monthly_sales")
+async def monthly_sales(ctx: RequestContext = Depends()):
+    orders = await ctx.orders(history=False)
+    labels, sales = await db.run(orders.get_monthly_sales)
+    return {"labels": labels, "sales": sales}
+
+
+@router.get("/ingredients")
+async def ingredients(start: date = None, end: date = None, normalize: bool = True, ctx: RequestContext = Depends()):
     try:
-        predictions = models.Prediction.objects.get(user_id=user_id)
+        predictions = await db.get_prediction(ctx.user_id)
+        restaurant = await ctx.restaurant()
     except Exception:
-        predictions = models.Prediction(user_id=user_id)
-        predictions.save()
-    predictions.predict()
+        return Response(status_code=404)
+
+    if not (start and end):
+        horizon = predictions.get_horizon()
+        if not horizon:
+            return Response(status_code=404)
+        start = start or horizon[0].date
+        end = end or horizon[-1].date
+
+    orders = predictions.get_predictions(start, end)
+    return {"start": start, "end": end, "days": [order.date for order in orders],
+            "ingredients": compute_requirements(restaurant.menu, orders, normalize_units=normalize)}
+
+
+@router.post("/predict")
+async def predict(days: int = Form(None), test: bool = Form(False), ctx: RequestContext = Depends()):
+    if days is not None and not 0 < days <= models.MAX_FORECAST_DAYS:
+        if test:
+            return Response(status_code=400)
+        return RedirectResponse("/", status_code=302)
+
+    try:
+        # the stored forecast already matches the current sales, menu and model
+        if await db.run(models.forecast_is_current, ObjectId(ctx.user_id), days):
+            job_id = prediction_worker.finished(ctx.user_id)
+        else:
+            job_id = prediction_worker.submit(ctx.user_id, days)
+    except prediction_worker.QueueFull:
+        if test:
+            return Response(status_code=503)
+        return RedirectResponse("/", status_code=302)
+
+    if test:
+        return {"job_id": job_id}
     return RedirectResponse("/", status_code=302)
 
+
+@router.get("/predict/status")
+async def predict_status(job_id: str = None, ctx: RequestContext = Depends()):
+    status = prediction_worker.get_status(job_id, ctx.user_id)
+    if not status:
+        return Response(status_code=404)
+    return status
+
 @router.post("/delete")
 async def delete(test: bool = Form(False), authorize: AuthJWT = Depends()):
 
@@ -521,14 +520,14 @@ async def delete(test: bool = Form(False), authorize: AuthJWT = Depends()):
 
     user_id = authorize.get_jwt_subject()
 
-    user = models.User.objects.get(id=user_id)
-    user.delete()
-    user_id = ObjectId(user_id)
+    user = await db.get_user(user_id)
+    await db.delete(user)
+    request_context.invalidate(user_id)
 
-    restaurant = models.Restaurant.objects.get(user_id=user_id)
-    restaurant.delete()
+    restaurant = await db.get_restaurant(user_id)
+    await db.delete(restaurant)
 
-    orders = models.Orders.objects.get(user_id=user_id)
-    orders.delete()
+    orders = await db.load_orders(user_id)
+    await db.delete(orders)
 
     return Response(status_code=200)
\ No newline at end of file
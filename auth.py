@@ -1,11 +1,34 @@
+import os
+
+from anyio import CapacityLimiter, to_thread
 from passlib.context import CryptContext
 
+# bcrypt cost; stored hashes made with a different cost are rehashed on the next login
+BCRYPT_ROUNDS = int(os.environ.get("BCRYPT_ROUNDS", 12))
+# bcrypt releases the GIL, so hashes run in parallel on these threads while the event loop keeps serving
+HASH_THREADS = int(os.environ.get("HASH_THREADS", 4))
+
 
 class AuthHandler:
-    pwd_context = CryptContext(schemes=['bcrypt'], deprecated='auto')
+    pwd_context = CryptContext(schemes=['bcrypt'], deprecated='auto', bcrypt__default_rounds=BCRYPT_ROUNDS,
+                               bcrypt__min_rounds=BCRYPT_ROUNDS, bcrypt__max_rounds=BCRYPT_ROUNDS)
+    _limiter = None
 
     def get_password_hash(self, password):
         return self.pwd_context.hash(password)
 
     def verify_password(self, plain_password, hashed_password):
         return self.pwd_context.verify(plain_password, hashed_password)
+
+    async def _run(self, func, *args):
+        # created lazily because anyio needs a running event loop
+        if AuthHandler._limiter is None:
+            AuthHandler._limiter = CapacityLimiter(HASH_THREADS)
+        return await to_thread.run_sync(func, *args, limiter=AuthHandler._limiter)
+
+    async def hash_password(self, password):
+        return await self._run(self.pwd_context.hash, password)
+
+    # returns (valid, new_hash); new_hash is set when the stored hash should be replaced
+    async def check_password(self, plain_password, hashed_password):
+        return await self._run(self.pwd_context.verify_and_update, plain_password, hashed_password)
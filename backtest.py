@@ -0,0 +1,169 @@
+import csv
+import time
+from datetime import timedelta
+
+import numpy as np
+
+import features
+from sales_import import parse_row
+
+# replays sales history one day at a time: the forecast for day d is what Prediction.predict would have
+# made on d (actual lag-1 and lag-7 sales, one day ahead), and it is scored against what was really sold.
+# every replayed day goes into one feature matrix, so the model runs once per batch instead of once per day
+
+
+# columnar history from an exported sales file in the upload format (id, quantity, m/d/Y);
+# like the upload, a later row for the same day and element replaces the earlier one
+def history_from_csv(file):
+    sales = {}
+    for row in csv.reader(file):
+        try:
+            day, element_id, quantity = parse_row(row)
+        except ValueError:
+            # a header, blank or malformed line; the upload reports these as failed rows, the backtest skips them
+            continue
+        sales[day, element_id] = quantity
+
+    vocabulary = sorted({element_id for _, element_id in sales})
+    index = {element_id: i for i, element_id in enumerate(vocabulary)}
+    return (np.array([day for day, _ in sales], dtype="datetime64[D]"),
+            np.array([index[element_id] for _, element_id in sales], dtype=np.int64),
+            np.array(list(sales.values()), dtype=np.float32), vocabulary)
+
+
+# no header row, so the file can be uploaded again as it is
+def write_csv(orders, file):
+    writer = csv.writer(file)
+    for order in orders.get_orders():
+        for sale in order.sales:
+            writer.writerow([sale.element_id, sale.quantity, order.date.strftime("%m/%d/%Y")])
+
+
+class ElementScore:
+
+    def __init__(self, element_id):
+        self.element_id = element_id
+        self.days = 0
+        self.absolute_error = 0.0
+        self.naive_error = 0.0
+        self.percentage_error = 0.0
+        self.percentage_days = 0
+
+    def add(self, predicted, actual, yesterday):
+        self.days += len(actual)
+        self.absolute_error += float(np.abs(predicted - actual).sum())
+        self.naive_error += float(np.abs(yesterday - actual).sum())
+        # days without sales have no percentage error
+        sold = actual != 0
+        self.percentage_error += float((np.abs(predicted[sold] - actual[sold]) / np.abs(actual[sold])).sum())
+        self.percentage_days += int(sold.sum())
+
+    def mae(self):
+        return self.absolute_error / self.days if self.days else None
+
+    def naive_mae(self):
+        return self.naive_error / self.days if self.days else None
+
+    def mape(self):
+        return self.percentage_error / self.percentage_days * 100 if self.percentage_days else None
+
+
+class BacktestResult:
+
+    def __init__(self):
+        self.scores = {}
+        self.start = None
+        self.end = None
+        self.rows = 0
+        self.unscored = 0
+        self.feature_seconds = 0.0
+        self.predict_seconds = 0.0
+
+    def score(self, element_id):
+        if element_id not in self.scores:
+            self.scores[element_id] = ElementScore(element_id)
+        return self.scores[element_id]
+
+    def total(self):
+        total = ElementScore("all")
+        for score in self.scores.values():
+            total.days += score.days
+            total.absolute_error += score.absolute_error
+            total.naive_error += score.naive_error
+            total.percentage_error += score.percentage_error
+            total.percentage_days += score.percentage_days
+        return total
+
+
+def backtest(history, predict, start=None, end=None, batch_days=90, result=None, encoding=features.ONE_HOT):
+    dates, elements, quantities, vocabulary = history
+    result = result or BacktestResult()
+    if len(dates) == 0:
+        return result
+
+    order = np.argsort(dates, kind="stable")
+    dates, elements, quantities = dates[order], elements[order], quantities[order]
+
+    # the first day with a week of history behind it, up to the last recorded day
+    start = max(start or dates.min().item(), dates.min().item() + timedelta(days=7))
+    end = min(end or dates.max().item(), dates.max().item())
+    if start > end:
+        return result
+    result.start = min(result.start or start, start)
+    result.end = max(result.end or end, end)
+
+    day = start
+    while day <= end:
+        last = min(day + timedelta(days=batch_days - 1), end)
+
+        # each batch only sees its own days and the week in front of them
+        window = slice(np.searchsorted(dates, np.datetime64(day - timedelta(days=7), "D")),
+                       np.searchsorted(dates, np.datetime64(last, "D"), side="right"))
+        batch = (dates[window], elements[window], quantities[window], vocabulary)
+
+        started = time.perf_counter()
+        row_days, row_elements, matrix = features.build_feature_matrix(*batch, day, last, encoding)
+        built = time.perf_counter()
+        predicted = np.asarray(predict(matrix), dtype=np.float32).reshape(-1) if len(matrix) else np.zeros(0, np.float32)
+        result.feature_seconds += built - started
+        result.predict_seconds += time.perf_counter() - built
+
+        actual = features.sold_quantities(*batch, row_days, row_elements)
+        scored = ~np.isnan(actual)
+        result.rows += len(matrix)
+        result.unscored += int((~scored).sum())
+
+        yesterday = matrix[:, features.YESTERDAY_QUANTITY]
+        for i in np.unique(row_elements[scored]):
+            rows = scored & (row_elements == i)
+            result.score(vocabulary[i]).add(predicted[rows], actual[rows], yesterday[rows])
+
+        day = last + timedelta(days=1)
+
+    return result
+
+
+def format_number(value, suffix=""):
+    return "-" if value is None else f"{value:.2f}{suffix}"
+
+
+def report(result, restaurants=1):
+    if not result.scores:
+        return "nothing to score: no element has a week of history with sales on consecutive days"
+
+    lines = [f"{'element':<16}{'days':>8}{'MAE':>10}{'MAPE':>10}{'naive MAE':>12}"]
+    for score in sorted(result.scores.values(), key=lambda score: score.element_id):
+        lines.append(f"{score.element_id:<16}{score.days:>8}{format_number(score.mae()):>10}"
+                     f"{format_number(score.mape(), '%'):>10}{format_number(score.naive_mae()):>12}")
+    total = result.total()
+    lines.append(f"{'all':<16}{total.days:>8}{format_number(total.mae()):>10}"
+                 f"{format_number(total.mape(), '%'):>10}{format_number(total.naive_mae()):>12}")
+
+    seconds = result.feature_seconds + result.predict_seconds
+    lines.append("")
+    lines.append(f"replayed {result.start} to {result.end} for {restaurants} restaurant(s): "
+                 f"{result.rows} forecasts, {result.unscored} without recorded sales")
+    lines.append(f"features {result.feature_seconds:.3f}s, model {result.predict_seconds:.3f}s, "
+                 f"{result.rows / seconds if seconds else 0:.0f} forecasts/s")
+    lines.append("naive MAE repeats yesterday's quantity, the model should beat it")
+    return "\n".join(lines)
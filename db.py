@@ -0,0 +1,83 @@
+import os
+from functools import partial
+
+from anyio import CapacityLimiter, to_thread
+from bson import ObjectId
+
+import models
+
+# mongoengine/pymongo are blocking, so every query runs on a worker thread and the
+# event loop stays free for other requests. keep this at or below pymongo's maxPoolSize
+DB_THREADS = int(os.environ.get("DB_THREADS", 40))
+
+_limiter = None
+
+
+def _get_limiter():
+    global _limiter
+    # created lazily because anyio needs a running event loop
+    if _limiter is None:
+        _limiter = CapacityLimiter(DB_THREADS)
+    return _limiter
+
+
+async def run(func, *args, **kwargs):
+    return await to_thread.run_sync(partial(func, *args, **kwargs), limiter=_get_limiter())
+
+
+async def save(document):
+    return await run(document.save)
+
+
+async def delete(document):
+    return await run(document.delete)
+
+
+async def get_user(user_id):
+    return await run(models.User.objects.get, id=user_id)
+
+
+async def find_user(email):
+    return await run(models.User.objects(email=email).first)
+
+
+async def email_exists(email):
+    return await run(models.User.objects(email=email).count) > 0
+
+
+async def get_restaurant(user_id):
+    return await run(models.Restaurant.objects.get, user_id=ObjectId(user_id))
+
+
+async def load_orders(user_id, history=True):
+    return await run(models.load_orders, ObjectId(user_id), history)
+
+
+async def create_orders(user_id):
+    return await run(models.create_orders, user_id)
+
+
+async def get_prediction(user_id):
+    return await run(models.Prediction.objects.get, user_id=ObjectId(user_id))
+
+
+async def get_charity(charity_id):
+    return await run(models.Charity.objects.get, id=ObjectId(charity_id))
+
+
+async def delete_charity(charity_id):
+    return await run(models.Charity.objects(id=ObjectId(charity_id)).delete)
+
+
+# raw dicts holding only the fields a list page renders: no Document objects, no JSON round trip
+async def get_menu(user_id, fields=("element_id", "name")):
+    query = models.Restaurant.objects(user_id=ObjectId(user_id)).only(*("menu." + field for field in fields))
+    restaurant = await run(query.as_pymongo().first)
+    if restaurant is None:
+        return None
+    return restaurant.get("menu", [])
+
+
+async def get_charity_list(location=None, fields=("name", "phone", "location", "location_url")):
+    query = models.Charity.objects.all() if location is None else models.Charity.objects(location=location)
+    return await run(list, query.only(*fields).as_pymongo())
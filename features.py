@@ -0,0 +1,189 @@
+import zlib
+
+import numpy as np
+
+import holiday_calendar
+
+# columns of the original one-hot layout
+FEATURE_COUNT = 18
+
+WEEKEND = 0
+HOLIDAY = 1
+LAST_WEEK_QUANTITY = 2
+YESTERDAY_QUANTITY = 3
+FIRST_ELEMENT_COLUMN = 4
+# offsets from the encoding's first season column, which follows the element columns
+FALL, SPRING, SUMMER, WINTER = 0, 1, 2, 3
+
+# one-hot column of each element the model was trained on
+element_ids = {
+    "sk-0003": 4,
+    "sk-0004": 5,
+    "sk-0005": 6,
+    "sk-0009": 7,
+    "sk-0012": 8,
+    "sk-0015": 9,
+    "sk-0016": 10,
+    "sk-0017": 11,
+    "sk-0195": 12,
+    "sk-0602": 13
+}
+
+
+# the ten elements the original model was trained on, one column each; any other element is never forecast
+class OneHotElements:
+    name = "one-hot"
+
+    def __init__(self):
+        self.width = len(element_ids)
+        self.first_season_column = FIRST_ELEMENT_COLUMN + self.width
+        self.feature_count = self.first_season_column + 4
+
+    # (vocabulary, columns) element columns, -1 for elements the encoding cannot represent
+    def columns(self, vocabulary):
+        return np.array([element_ids.get(element_id, -1) for element_id in vocabulary], dtype=np.int64).reshape(-1, 1)
+
+    def describe(self):
+        return {"encoding": self.name}
+
+
+# any element id, hashed into `buckets` columns by `hashes` independent hashes, so elements that share
+# one column still differ in the other; a new menu item needs no retraining to get a forecast
+class HashedElements:
+    name = "hashed"
+
+    def __init__(self, buckets=64, hashes=2):
+        self.buckets = buckets
+        self.hashes = hashes
+        self.width = buckets
+        self.first_season_column = FIRST_ELEMENT_COLUMN + self.width
+        self.feature_count = self.first_season_column + 4
+
+    def columns(self, vocabulary):
+        return np.array([[FIRST_ELEMENT_COLUMN + zlib.crc32(f"{i}:{element_id}".encode()) % self.buckets
+                          for i in range(self.hashes)] for element_id in vocabulary], dtype=np.int64).reshape(-1, self.hashes)
+
+    def describe(self):
+        return {"encoding": self.name, "buckets": self.buckets, "hashes": self.hashes}
+
+
+ONE_HOT = OneHotElements()
+
+
+# the encoding a model was trained with, from its describe() output
+def element_encoding(encoding="one-hot", **params):
+    if encoding == OneHotElements.name:
+        return ONE_HOT
+    if encoding == HashedElements.name:
+        return HashedElements(**params)
+    raise ValueError(f"unknown element encoding {encoding!r}")
+
+
+# flattens Order documents into columnar (dates, element indices, quantities, vocabulary);
+# with a fixed vocabulary, sales of other elements are dropped
+def history_from_orders(orders, vocabulary=None, start=None, end=None):
+    fixed = vocabulary is not None
+    vocabulary = list(vocabulary) if fixed else []
+    index = {element_id: i for i, element_id in enumerate(vocabulary)}
+
+    dates, elements, quantities = [], [], []
+    for order in orders:
+        if (start and order.date < start) or (end and order.date > end):
+            continue
+        for sale in order.sales:
+            i = index.get(sale.element_id)
+            if i is None:
+                if fixed:
+                    continue
+                i = index[sale.element_id] = len(vocabulary)
+                vocabulary.append(sale.element_id)
+            dates.append(order.date)
+            elements.append(i)
+            quantities.append(sale.quantity or 0)
+
+    return (np.array(dates, dtype="datetime64[D]"), np.array(elements, dtype=np.int64),
+            np.array(quantities, dtype=np.float32), vocabulary)
+
+
+def _seasons(days):
+    months = days.astype("datetime64[M]")
+    month_day = (months.astype(np.int64) % 12 + 1) * 100 + (days - months).astype(np.int64) + 1
+
+    seasons = np.full(len(days), WINTER, dtype=np.int64)
+    seasons[(month_day > 621) & (month_day <= 922)] = SUMMER
+    seasons[(month_day >= 321) & (month_day <= 621)] = SPRING
+    seasons[(month_day >= 923) & (month_day <= 1220)] = FALL
+    return seasons
+
+
+# one row for every (day, element) in [start, end] with both a lag-1 and a lag-7 sale that the encoding
+# can represent, ordered by day and then by vocabulary; returns (row days, row element indices, matrix)
+def build_feature_matrix(dates, elements, quantities, vocabulary, start, end, encoding=ONE_HOT):
+    start = np.datetime64(start, "D")
+    end = np.datetime64(end, "D")
+    # sales after `end` (later history, fed-back forecasts) are no feature of [start, end] and fall outside the grid
+    known = dates <= end
+    dates, elements, quantities = dates[known], elements[known], quantities[known]
+    first_day = min(dates.min(), start - 7) if len(dates) else start - 7
+
+    grid = np.full(((end - first_day).astype(np.int64) + 1, len(vocabulary)), np.nan, dtype=np.float32)
+    grid[(dates - first_day).astype(np.int64), elements] = quantities
+
+    targets = np.arange(start, end + 1, dtype="datetime64[D]")
+    offsets = (targets - first_day).astype(np.int64)
+    yesterday = grid[offsets - 1]
+    last_week = grid[offsets - 7]
+
+    slots = encoding.columns(vocabulary)
+    mask = ~np.isnan(yesterday) & ~np.isnan(last_week) & (slots[:, 0] >= 0)
+    day_rows, element_rows = np.nonzero(mask)
+
+    row_days = targets[day_rows]
+    rows = np.arange(len(day_rows))
+    features = np.zeros((len(day_rows), encoding.feature_count), dtype=np.float32)
+
+    weekdays = (row_days.astype(np.int64) + 3) % 7
+    features[:, WEEKEND] = (weekdays >= 3) & (weekdays <= 5)
+    features[:, HOLIDAY] = holiday_calendar.is_holiday_array(row_days)
+    features[:, LAST_WEEK_QUANTITY] = last_week[day_rows, element_rows]
+    features[:, YESTERDAY_QUANTITY] = yesterday[day_rows, element_rows]
+    features[rows[:, None], slots[element_rows]] = 1
+    features[rows, encoding.first_season_column + _seasons(row_days)] = 1
+
+    return row_days, element_rows, features
+
+
+# recursive multi-day forecast starting at `start`: every day's predictions are fed back as the
+# lag-1/lag-7 quantities of the following days, and predict(matrix) runs once per day for all elements.
+# returns [(day, element indices, predicted quantities)], stopping early once no element has both lags
+def forecast(dates, elements, quantities, vocabulary, start, days, predict, encoding=ONE_HOT):
+    results = []
+    for step in range(days):
+        day = np.datetime64(start, "D") + step
+        _, rows, matrix = build_feature_matrix(dates, elements, quantities, vocabulary, day, day, encoding)
+        if len(rows) == 0:
+            break
+
+        predicted = np.asarray(predict(matrix), dtype=np.float32).reshape(-1)
+        results.append((day, rows, predicted))
+
+        dates = np.concatenate([dates, np.full(len(rows), day)])
+        elements = np.concatenate([elements, rows])
+        quantities = np.concatenate([quantities, predicted])
+
+    return results
+
+
+# sold quantity of each (day, element) row, nan where no sale was recorded
+def sold_quantities(dates, elements, quantities, vocabulary, row_days, row_elements):
+    keys = dates.astype(np.int64) * len(vocabulary) + elements
+    order = np.argsort(keys)
+    keys = keys[order]
+
+    wanted = row_days.astype(np.int64) * len(vocabulary) + row_elements
+    found = np.minimum(np.searchsorted(keys, wanted), max(len(keys) - 1, 0))
+    sold = np.full(len(wanted), np.nan, dtype=np.float32)
+    if len(keys):
+        hit = keys[found] == wanted
+        sold[hit] = quantities[order][found[hit]]
+    return sold
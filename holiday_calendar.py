@@ -0,0 +1,68 @@
+import json
+import os
+from bisect import bisect_right
+from datetime import datetime
+
+import numpy as np
+
+HOLIDAYS_FILE = os.environ.get("HOLIDAYS_FILE", "holidays.json")
+_EPOCH_ORDINAL = datetime(1970, 1, 1).toordinal()
+
+
+def _parse(day):
+    return datetime.strptime(day, "%d/%m/%Y").date()
+
+
+def compile_holidays(holidays):
+    intervals = []
+    for holiday in holidays:
+        start, end = _parse(holiday["start"]), _parse(holiday["end"])
+        # an end before its start never matched anything, keep it that way
+        if start <= end:
+            intervals.append((start.toordinal(), end.toordinal()))
+
+    intervals.sort()
+    merged = []
+    for start, end in intervals:
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+
+    starts = np.array([start for start, _ in merged], dtype=np.int64)
+    ends = np.array([end for _, end in merged], dtype=np.int64)
+    return starts, ends
+
+
+def load_holidays(path=HOLIDAYS_FILE):
+    global _starts, _ends, _start_list, _end_list
+    try:
+        with open(path) as file:
+            text = file.read()
+    except FileNotFoundError:
+        # forecasting still works without a calendar, no day is a holiday
+        print(f"holiday calendar {path} not found")
+        text = ""
+    # an empty file is an empty calendar too
+    holidays = json.loads(text) if text.strip() else []
+    _starts, _ends = compile_holidays(holidays or [])
+    _start_list = _starts.tolist()
+    _end_list = _ends.tolist()
+
+
+def is_holiday(day):
+    day = day.toordinal()
+    i = bisect_right(_start_list, day) - 1
+    return i >= 0 and day <= _end_list[i]
+
+
+def is_holiday_array(days):
+    # days: numpy datetime64[D] array
+    days = days.astype("datetime64[D]").astype(np.int64) + _EPOCH_ORDINAL
+    if len(_starts) == 0:
+        return np.zeros(len(days), dtype=bool)
+    i = np.searchsorted(_starts, days, side="right") - 1
+    return (i >= 0) & (days <= _ends[np.maximum(i, 0)])
+
+
+load_holidays()
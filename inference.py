@@ -0,0 +1,97 @@
+import numpy as np
+
+import features
+
+# Normalization uses the keras backend epsilon as the floor of the standard deviation
+EPSILON = 1e-7
+
+ACTIVATIONS = {
+    "linear": lambda x: x,
+    "relu": lambda x: np.maximum(x, 0),
+    "sigmoid": lambda x: 1 / (1 + np.exp(-x)),
+    "tanh": np.tanh,
+}
+
+
+# what the forecasting code needs from a model: predict(matrix) -> (rows, 1) quantities, the element
+# encoding its feature matrix uses, and the version forecasts made with it are fingerprinted with
+class InferenceBackend:
+    encoding = features.ONE_HOT
+    version = None
+
+    def predict(self, matrix, batch_size=None, verbose=0):
+        raise NotImplementedError
+
+
+class KerasBackend(InferenceBackend):
+
+    def __init__(self, model_path):
+        from tensorflow import keras
+        self.model = keras.models.load_model(model_path)
+
+    def predict(self, matrix, batch_size=None, verbose=0):
+        return self.model.predict(matrix, batch_size=batch_size, verbose=verbose)
+
+
+# the exported Normalization -> Dense stack evaluated with numpy; no tensorflow import
+class NumpyBackend(InferenceBackend):
+
+    def __init__(self, weights_path):
+        with np.load(weights_path) as weights:
+            # weights exported before the encoding was recorded are one-hot
+            if "encoding" in weights:
+                params = {key[len("encoding_"):]: int(weights[key]) for key in weights.files if key.startswith("encoding_")}
+                self.encoding = features.element_encoding(str(weights["encoding"]), **params)
+            self.mean = weights["mean"].astype(np.float32)
+            self.scale = np.maximum(np.sqrt(weights["variance"].astype(np.float32)), np.float32(EPSILON))
+            self.layers = [(weights[f"dense_{i}_kernel"].astype(np.float32), weights[f"dense_{i}_bias"].astype(np.float32),
+                            ACTIVATIONS[str(activation)])
+                           for i, activation in enumerate(weights["activations"])]
+
+    def predict(self, matrix, batch_size=None, verbose=0):
+        x = (np.asarray(matrix, dtype=np.float32) - self.mean) / self.scale
+        for kernel, bias, activation in self.layers:
+            x = activation(x @ kernel + bias)
+        return x
+
+
+# the arrays NumpyBackend reads: normalization statistics, [(kernel, bias)] per dense layer and the encoding
+def weights_arrays(mean, variance, layers, activations, encoding=features.ONE_HOT):
+    arrays = {"mean": np.asarray(mean, dtype=np.float32).reshape(-1),
+              "variance": np.asarray(variance, dtype=np.float32).reshape(-1),
+              "activations": np.array(activations)}
+    for i, (kernel, bias) in enumerate(layers):
+        arrays[f"dense_{i}_kernel"] = np.asarray(kernel, dtype=np.float32)
+        arrays[f"dense_{i}_bias"] = np.asarray(bias, dtype=np.float32)
+
+    description = encoding.describe()
+    arrays["encoding"] = np.array(description.pop("encoding"))
+    for key, value in description.items():
+        arrays[f"encoding_{key}"] = np.array(value)
+    return arrays
+
+
+# writes a Keras Normalization + Dense model in the layout NumpyBackend reads
+def export_weights(model, weights_path):
+    from tensorflow import keras
+
+    normalization = None
+    layers = []
+    activations = []
+    for layer in model.layers:
+        if isinstance(layer, keras.layers.Normalization):
+            normalization = layer
+        elif isinstance(layer, keras.layers.Dense):
+            layers.append(layer.get_weights())
+            activations.append(keras.activations.serialize(layer.activation))
+        elif not isinstance(layer, keras.layers.InputLayer):
+            raise ValueError(f"layer {layer.name} ({type(layer).__name__}) has no numpy implementation")
+
+    if normalization is None:
+        raise ValueError("the model has no Normalization layer")
+    unsupported = set(activations) - set(ACTIVATIONS)
+    if unsupported:
+        raise ValueError(f"unsupported activations: {', '.join(sorted(unsupported))}")
+
+    # the SavedModel was trained on the one-hot layout
+    np.savez(weights_path, **weights_arrays(normalization.mean, normalization.variance, layers, activations))
@@ -0,0 +1,62 @@
+# base unit and factor for the units that can be merged
+UNITS = {
+    "mg": ("g", 0.001),
+    "g": ("g", 1),
+    "kg": ("g", 1000),
+    "ml": ("ml", 1),
+    "l": ("ml", 1000),
+}
+
+# larger unit to display a base quantity in once it reaches the factor
+DISPLAY_UNITS = {
+    "g": ("kg", 1000),
+    "ml": ("l", 1000),
+}
+
+
+def index_menu(menu):
+    return {element.element_id: element for element in menu}
+
+
+def _normalize(quantity, unit):
+    base = UNITS.get((unit or "").strip().lower())
+    if not base:
+        return quantity, unit
+    return quantity * base[1], base[0]
+
+
+def _display(quantity, unit):
+    display = DISPLAY_UNITS.get(unit)
+    if display and quantity >= display[1]:
+        return quantity / display[1], display[0]
+    return quantity, unit
+
+
+# total ingredient requirements for the predicted sales of one or more forecast days
+def compute_requirements(menu, predicted_orders, normalize_units=False):
+    elements = index_menu(menu)
+
+    totals = {}
+    for order in predicted_orders:
+        for sale in order.sales:
+            element = elements.get(sale.element_id)
+            if not element:
+                continue
+
+            for ingredient in element.ingredients:
+                # nothing to add up for an ingredient (or sale) stored without a quantity
+                if ingredient.quantity is None or sale.quantity is None:
+                    continue
+                quantity, unit = sale.quantity * ingredient.quantity, ingredient.unit
+                if normalize_units:
+                    quantity, unit = _normalize(quantity, unit)
+                key = (ingredient.name, unit)
+                totals[key] = totals.get(key, 0) + quantity
+
+    requirements = []
+    for (name, unit), quantity in totals.items():
+        if normalize_units:
+            quantity, unit = _display(quantity, unit)
+        requirements.append({"name": name, "quantity": round(quantity, 2), "unit": unit})
+
+    return requirements
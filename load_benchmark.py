@@ -0,0 +1,73 @@
+import argparse
+import asyncio
+import json
+import time
+from urllib.parse import urlencode, urlsplit
+from urllib.request import Request, urlopen
+
+# usage: start the server (uvicorn main:app --workers 1), then
+#   python load_benchmark.py --email user@example.com --password ... --concurrency 1 8 32
+# with blocking handlers requests/s stays flat as concurrency grows; with the
+# threadpool-backed db layer it should keep climbing until mongo or the pool saturates
+
+
+def login(base_url, email, password):
+    data = urlencode({"email": email, "password": password, "test": True}).encode()
+    with urlopen(Request(base_url + "/api/login", data=data)) as response:
+        return json.loads(response.read())["access_token"]
+
+
+async def fetch(host, port, path, token):
+    reader, writer = await asyncio.open_connection(host, port)
+    writer.write((f"GET {path} HTTP/1.1\r\nHost: {host}\r\nCookie: access_token_cookie={token}\r\n"
+                  "Connection: close\r\n\r\n").encode())
+    await writer.drain()
+    status_line = await reader.readline()
+    await reader.read()
+    writer.close()
+    return int(status_line.split()[1])
+
+
+async def run_level(host, port, paths, token, concurrency, requests):
+    latencies = []
+    errors = 0
+    remaining = iter(range(requests))
+
+    async def client():
+        nonlocal errors
+        for i in remaining:
+            started = time.perf_counter()
+            status = await fetch(host, port, paths[i % len(paths)], token)
+            latencies.append(time.perf_counter() - started)
+            if status >= 400:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    p50 = latencies[len(latencies) // 2] * 1000
+    p95 = latencies[int(len(latencies) * 0.95) - 1] * 1000
+    print(f"concurrency {concurrency:4d}: {requests / elapsed:8.1f} req/s  "
+          f"p50 {p50:7.1f} ms  p95 {p95:7.1f} ms  errors {errors}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--email", required=True)
+    parser.add_argument("--password", required=True)
+    parser.add_argument("--paths", nargs="+", default=["/", "/menu", "/sales", "/charity"])
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32, 64])
+    parser.add_argument("--requests", type=int, default=500)
+    args = parser.parse_args()
+
+    token = login(args.url, args.email, args.password)
+    url = urlsplit(args.url)
+    for concurrency in args.concurrency:
+        asyncio.run(run_level(url.hostname, url.port or 80, args.paths, token, concurrency, args.requests))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,7 @@
 import os
-from json import loads
-from bson import ObjectId
 from fastapi import FastAPI, Depends, Request
-# from CONFIG import CONNECTION_URL
-from mongoengine import connect
 from starlette.responses import RedirectResponse
+import db
 import models
 from auth import AuthHandler
 from datetime import date
@@ -14,13 +11,15 @@ from schemas import Settings
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from API import router as api_router
+from request_context import RequestContext
+from ingredients import compute_requirements
+import prediction_worker
+import validators
 
 
 app = FastAPI()
 app.include_router(api_router)
-CONNECTION_URL = os.environ.get("CONNECTION_URL")
-
-connect(db='GraduationProject', host=CONNECTION_URL)
+models.connect_database()
 
 authHandler = AuthHandler()
 
@@ -29,6 +28,17 @@ app.mount("/auth_static", StaticFiles(directory="assets/auth"), name="auth_stati
 templates = Jinja2Templates(directory="html")
 
 
+@app.on_event("startup")
+def warm_up_model():
+    if os.environ.get("WARM_UP_MODEL"):
+        prediction_worker.warm_up()
+
+
+@app.on_event("shutdown")
+def stop_prediction_workers():
+    prediction_worker.shutdown()
+
+
 @AuthJWT.load_config
 def get_config():
     return Settings()
@@ -40,28 +50,24 @@ async def authjwt_exception_handler(request: Request, exc: AuthJWTException):
 
 
 def from_document_to_dict(document):
-    json = document.to_json()
-    return loads(json)
+    return document.to_mongo().to_dict()
+
+
+# one row per element with its predicted quantity on each forecast day
+def forecast_table(horizon):
+    rows = {}
+    for day, order in enumerate(horizon):
+        for sale in order.sales:
+            rows.setdefault(sale.element_id, [0] * len(horizon))[day] = round(sale.quantity, 1)
+    return [{"element_id": element_id, "quantities": quantities} for element_id, quantities in rows.items()]
 
 
 @app.get("/register")
 async def register_page(request: Request, error=None):
     load = {"request": request}
-    if error == "empty":
-
-        load["message"] = "please fill the form completely"
-
-    elif error == "email":
-        load["message"] = "email already registered"
-
-    elif error == "password":
-        load["message"] = "please use a stronger password"
-
-    elif error == "match":
-        load["message"] = "passwords does not match"
-
-    elif error == "phone":
-        load["message"] = "please enter your phone number correctly"
+    message = validators.get_message(error)
+    if message:
+        load["message"] = message
 
     return templates.TemplateResponse("Sinup.html", load)
 
@@ -84,20 +90,20 @@ async def logout(authorize: AuthJWT = Depends()):
     return RedirectResponse("/login")
 
 @app.get("/")
-async def main_page(request: Request, authorize: AuthJWT = Depends()):
-    authorize.jwt_required()
+async def main_page(request: Request, ctx: RequestContext = Depends()):
 
-    user = models.User.objects.get(id=authorize.get_jwt_subject())
+    user = await ctx.user()
     first_name = user.first_name
     last_name = user.last_name
 
-
-    orders = models.Orders.objects.get(user_id=ObjectId(authorize.get_jwt_subject()))
     if not user.is_admin():
-        monthly_labels, monthly_sales = orders.get_monthly_sales()
+        orders = await ctx.orders(history=False)
+        monthly_labels, monthly_sales = await db.run(orders.get_monthly_sales)
 
-        weekly_labels, weekly_sales = orders.get_most_sales_in_week()
+        weekly_labels, weekly_sales = await db.run(orders.get_most_sales_in_week)
         load = {"request": request,
+                                                         "horizon_days": models.FORECAST_DAYS,
+                                                         "max_horizon_days": models.MAX_FORECAST_DAYS,
                                                          "first_name": first_name,
                                                          "last_name": last_name,
                                                          "monthly_labels": monthly_labels,
@@ -105,45 +111,26 @@ async def main_page(request: Request, authorize: AuthJWT = Depends()):
                                                          "weekly_labels": weekly_labels,
                                                          "weekly_sales": weekly_sales
                                                          }
-        ingredients = []
         try:
-            predictions = models.Prediction.objects.get(user_id=ObjectId(authorize.get_jwt_subject()))
-            latest_prediction = predictions.get_latest_prediction()
-            time = latest_prediction.date
-            if latest_prediction:
-                restaurant = models.Restaurant.objects.get(user_id=ObjectId(authorize.get_jwt_subject()))
-                for element in restaurant.menu:
-                    for predicted_element in latest_prediction.sales:
-                        if element.element_id == predicted_element.element_id:
-                            for ingredient in element.ingredients:
-                                to_add = predicted_element.quantity * ingredient.quantity
-                                added = False
-                                for i, existing_ingredient in enumerate(ingredients):
-                                    if existing_ingredient["name"] == ingredient.name:
-                                        ingredients[i]["quantity"] += round(to_add, 2)
-                                        added = True
-                                        break
-
-                                if not added:
-                                    ingredients.append({"name": ingredient.name, "quantity": round(to_add, 2), "unit": ingredient.unit})
+            predictions = await db.get_prediction(ctx.user_id)
+            horizon = predictions.get_horizon()
+            if horizon:
+                restaurant = await ctx.restaurant()
+                ingredients = compute_requirements(restaurant.menu, horizon, normalize_units=True)
+                if ingredients:
+                    load["ingredients"] = ingredients
+                    load["date"] = horizon[0].date if len(horizon) == 1 else f"{horizon[0].date} - {horizon[-1].date}"
+                if len(horizon) > 1:
+                    load["forecast_days"] = [order.date.strftime("%m/%d") for order in horizon]
+                    load["forecast"] = forecast_table(horizon)
         except Exception as e:
             pass
 
-
-        if ingredients:
-
-            for i, ingredient in enumerate(ingredients):
-                ingredients[i]["quantity"] = round(ingredient["quantity"], 2)
-
-            load["ingredients"] = ingredients
-            load["date"] = time
-
         return templates.TemplateResponse("index.html", load)
 
-    charity_list = models.Charity.objects.all()
-    charity_list = from_document_to_dict(charity_list)
+    charity_list = await db.get_charity_list()
     for charity in charity_list:
-        charity["_id"] = charity["_id"]["$oid"]
+        charity["_id"] = str(charity["_id"])
 
     return templates.TemplateResponse("charity_admin.html", {"request": request,
                                                          "first_name": first_name,
@@ -152,9 +139,8 @@ async def main_page(request: Request, authorize: AuthJWT = Depends()):
 
 
 @app.get("/add_charity")
-async def add_charity(request: Request, authorize: AuthJWT = Depends()):
-    authorize.jwt_required()
-    user = models.User.objects.get(id=authorize.get_jwt_subject())
+async def add_charity(request: Request, ctx: RequestContext = Depends()):
+    user = await ctx.user()
     if not user.is_admin():
         return RedirectResponse("/", status_code=302)
 
@@ -162,68 +148,57 @@ async def add_charity(request: Request, authorize: AuthJWT = Depends()):
 
 
 @app.get("/edit_charity")
-async def edit_charity(request: Request, id=None, authorize: AuthJWT = Depends()):
-    authorize.jwt_required()
-    user = models.User.objects.get(id=authorize.get_jwt_subject())
+async def edit_charity(request: Request, id=None, ctx: RequestContext = Depends()):
+    user = await ctx.user()
     if not user.is_admin():
         return RedirectResponse("/", status_code=302)
 
     try:
-        charity = models.Charity.objects.get(id=ObjectId(id))
+        charity = await db.get_charity(id)
     except:
         return RedirectResponse("/", status_code=302)
 
     charity = from_document_to_dict(charity)
-    charity["id"] = charity["_id"]["$oid"]
+    charity["id"] = str(charity["_id"])
 
     load = {"request":request, "first_name":user.first_name, "last_name":user.last_name, "charity":charity, "edit":True}
     return templates.TemplateResponse("add_charity_admin.html", load)
 
 @app.get("/charity")
-async def charities(request: Request, authorize: AuthJWT = Depends()):
-    authorize.jwt_required()
-    user = models.User.objects.get(id=authorize.get_jwt_subject())
+async def charities(request: Request, ctx: RequestContext = Depends()):
+    user = await ctx.user()
     first_name = user.first_name
     last_name = user.last_name
     if not user.is_admin():
-        user_id = ObjectId(authorize.get_jwt_subject())
         try:
-            restaurant_location = models.Restaurant.objects.get(user_id=user_id).location
+            restaurant_location = (await ctx.restaurant()).location
         except:
             return RedirectResponse("/")
 
 
 
 
-        near_charities = models.Charity.objects(location=restaurant_location)
-        charity_list = from_document_to_dict(near_charities)
+        charity_list = await db.get_charity_list(restaurant_location, ("name", "phone", "location_url"))
         return templates.TemplateResponse("Charity.html", {"request":request, "charities": charity_list, "first_name": first_name, "last_name": last_name})
 
 
 @app.get("/menu")
-async def menu(request:Request, authorize: AuthJWT = Depends()):
-    authorize.jwt_required()
+async def menu(request:Request, ctx: RequestContext = Depends()):
 
-    user = models.User.objects.get(id=authorize.get_jwt_subject())
+    user = await ctx.user()
     first_name = user.first_name
     last_name = user.last_name
 
-    user_id = authorize.get_jwt_subject()
-    try:
-        menu_as_documents = models.Restaurant.objects.get(user_id=user_id).menu
-    except:
+    menu_list = await db.get_menu(ctx.user_id)
+    if menu_list is None:
         return RedirectResponse("/")
 
-    menu_list = []
-    for i, element in enumerate(menu_as_documents):
-        menu_list.append(from_document_to_dict(element))
     return templates.TemplateResponse("Menu.html", {"request":request, "elements": menu_list, "first_name": first_name, "last_name": last_name})
 
 @app.get("/menu/add")
-async def add_element(request:Request, authorize: AuthJWT = Depends()):
-    authorize.jwt_required()
+async def add_element(request:Request, ctx: RequestContext = Depends()):
 
-    user = models.User.objects.get(id=authorize.get_jwt_subject())
+    user = await ctx.user()
     first_name = user.first_name
     last_name = user.last_name
 
@@ -231,19 +206,17 @@ async def add_element(request:Request, authorize: AuthJWT = Depends()):
 
 
 @app.get("/menu/edit")
-async def edit_element(request:Request, authorize: AuthJWT = Depends(), element_id=None):
-    authorize.jwt_required()
+async def edit_element(request:Request, ctx: RequestContext = Depends(), element_id=None):
 
-    user = models.User.objects.get(id=authorize.get_jwt_subject())
+    user = await ctx.user()
     first_name = user.first_name
     last_name = user.last_name
 
-    user_id = ObjectId(authorize.get_jwt_subject())
     if not element_id:
         return RedirectResponse("/menu")
 
     try:
-        restaurant = models.Restaurant.objects.get(user_id=user_id)
+        restaurant = await ctx.restaurant()
     except:
         return RedirectResponse("/")
 
@@ -254,18 +227,16 @@ async def edit_element(request:Request, authorize: AuthJWT = Depends(), element_
 
 
 @app.get("/edit_ingredient")
-async def edit_ingredient(request:Request, authorize: AuthJWT = Depends(), element_id=None, number:int=None):
-    authorize.jwt_required()
+async def edit_ingredient(request:Request, ctx: RequestContext = Depends(), element_id=None, number:int=None):
 
-    user = models.User.objects.get(id=authorize.get_jwt_subject())
+    user = await ctx.user()
     first_name = user.first_name
     last_name = user.last_name
 
-    user_id = ObjectId(authorize.get_jwt_subject())
     if not element_id:
         return RedirectResponse("/menu")
     try:
-        restaurant = models.Restaurant.objects.get(user_id=user_id)
+        restaurant = await ctx.restaurant()
     except:
         return RedirectResponse("/")
 
@@ -276,75 +247,54 @@ async def edit_ingredient(request:Request, authorize: AuthJWT = Depends(), eleme
 
 
 @app.get("/sales")
-async def sales(request:Request, authorize: AuthJWT = Depends(), time: date=date.today()):
-    authorize.jwt_required()
+async def sales(request:Request, ctx: RequestContext = Depends(), time: date=date.today()):
 
-    user = models.User.objects.get(id=authorize.get_jwt_subject())
+    user = await ctx.user()
     first_name = user.first_name
     last_name = user.last_name
 
-    user_id = ObjectId(authorize.get_jwt_subject())
     load = {"request":request,  "first_name": first_name, "last_name": last_name}
     if time:
+        load["time"] = time
         try:
-            load["time"] = time
-            try:
-                all_orders = models.Orders.objects.get(user_id=user_id)
-            except:
-                return RedirectResponse("/")
-
-
+            orders = await ctx.orders(history=False)
         except:
-            all_orders = models.Orders(user_id=user_id)
-            all_orders.save()
-
-        orders = all_orders.get_order(time)
-        if orders:
-            sales = []
-
-            for sale in orders.sales:
-                sales.append(from_document_to_dict(sale))
-
-            if sales:
-                load["sales"] = sales
-
-            unused_elements = orders.get_unused_elements()
-
-            if unused_elements:
-                load["unused"] = unused_elements
-        else:
+            return RedirectResponse("/")
 
-            try:
-                restaurant = models.Restaurant.objects.get(user_id=user_id)
-            except:
-                return RedirectResponse("/")
+        sales = await db.run(orders.get_day_sales, time)
+        if sales:
+            load["sales"] = sales
 
-            unused_elements = restaurant.get_all_elements_id()
+        menu = await db.get_menu(ctx.user_id, ("element_id",))
+        if menu is None:
+            return RedirectResponse("/")
 
-            if unused_elements:
-                load["unused"] = unused_elements
+        sold = {sale["element_id"] for sale in sales or []}
+        unused_elements = [element["element_id"] for element in menu if element["element_id"] not in sold]
+        if unused_elements:
+            load["unused"] = unused_elements
 
     return templates.TemplateResponse("sales.html", load)
 
 @app.get("/edit_sale")
-async def edit_sale(request:Request, authorize: AuthJWT = Depends(), time: date=None, element_id=None):
-    authorize.jwt_required()
+async def edit_sale(request:Request, ctx: RequestContext = Depends(), time: date=None, element_id=None):
 
-    user = models.User.objects.get(id=authorize.get_jwt_subject())
+    user = await ctx.user()
     first_name = user.first_name
     last_name = user.last_name
 
-    user_id = ObjectId(authorize.get_jwt_subject())
-
     if not (time and element_id):
         return RedirectResponse(f"sales?time={time}")
 
     try:
-        orders = models.Orders.objects.get(user_id=user_id)
+        orders = await ctx.orders()
     except:
         return RedirectResponse("/")
 
-    order = orders.get_order(time)
+    # a query with daily storage, so it runs off the event loop
+    order = await db.run(orders.get_order, time)
+    if order is None:
+        return RedirectResponse(f"sales?time={time}")
 
     sale = order.get_sale(element_id)
 
@@ -359,25 +309,24 @@ async def edit_sale(request:Request, authorize: AuthJWT = Depends(), time: date=
 
 
 @app.get("/upload")
-async def upload(request:Request, authorize: AuthJWT = Depends(), error=None):
-    authorize.jwt_required()
+async def upload(request:Request, ctx: RequestContext = Depends(), error=None, imported: int = 0, failed: int = 0):
 
-    user = models.User.objects.get(id=authorize.get_jwt_subject())
+    user = await ctx.user()
     first_name = user.first_name
     last_name = user.last_name
 
     load = {"request": request, "first_name": first_name, "last_name": last_name}
-    if error:
+    if error == "rows":
+        load["message"] = f"{failed} rows could not be imported ({imported} imported)\\nMake sure that the columns are in order\\nid, quantity, date"
+    elif error:
         load["message"] = "Make sure that the columns are in order\\nid, quantity, date\\n and the file is saved in csv utf-8 format"
     return templates.TemplateResponse("upload.html", load)
 
 @app.get("/settings")
-async def settings(request: Request, authorize: AuthJWT = Depends(), error = None):
-    authorize.jwt_required()
-    user_id = authorize.get_jwt_subject()
+async def settings(request: Request, ctx: RequestContext = Depends(), error = None):
     try:
-        user = models.User.objects.get(id=user_id)
-        restaurant = models.Restaurant.objects.get(user_id=ObjectId(user_id))
+        user = await ctx.user()
+        restaurant = await ctx.restaurant()
     except:
         return RedirectResponse("/")
 
@@ -390,36 +339,24 @@ async def settings(request: Request, authorize: AuthJWT = Depends(), error = Non
         'location':restaurant.location
     }
 
-    if error == "empty":
-
-        load["message"] = "please fill the form completely"
-
-    elif error == "email":
-        load["message"] = "email already registered"
-
-    elif error == "password":
-        load["message"] = "please use a stronger password"
-
-    elif error == "match":
-        load["message"] = "passwords does not match"
-
-    elif error == "phone":
-        load["message"] = "please enter your phone number correctly"
+    message = validators.get_message(error)
+    if message:
+        load["message"] = message
 
     return templates.TemplateResponse("Settings.html", load)
 
 @app.get("/reset")
-def reset(request: Request, authorize: AuthJWT = Depends()):
-
-    authorize.jwt_required()
-    user_id = ObjectId(authorize.get_jwt_subject())
+async def reset(request: Request, ctx: RequestContext = Depends()):
 
-    orders = models.Orders.objects.get(user_id=user_id)
-    orders.orders = []
-    orders.save()
+    orders = await ctx.orders()
+    await db.run(orders.clear)
 
-    predictions = models.Prediction.objects.get(user_id=user_id)
+    # without its fingerprint and horizon, the same sales uploaded again are forecast again
+    predictions = await db.get_prediction(ctx.user_id)
     predictions.orders = []
-    predictions.save()
+    predictions.fingerprint = None
+    predictions.horizon_start = None
+    predictions.horizon_end = None
+    await db.save(predictions)
 
     return RedirectResponse("/", status_code=302)
\ No newline at end of file
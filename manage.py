@@ -0,0 +1,385 @@
+import argparse
+import sys
+import time
+from datetime import date, datetime, timedelta
+
+import numpy as np
+from bson import ObjectId
+from pymongo import ReplaceOne
+from pymongo.errors import OperationFailure
+
+import backtest
+import features
+import inference
+import model_registry
+import models
+import training
+from model_registry import get_model
+
+
+def _write_predictions(batch, predicted):
+    requests = []
+    offset = 0
+    for user_id, today, elements, fingerprint in batch:
+        order = models.Prediction.make_order(today, elements, predicted[offset:offset + len(elements)])
+        offset += len(elements)
+        requests.extend(models.Prediction.prediction_updates(user_id, order))
+        requests.append(models.Prediction.horizon_update(user_id, today, today, fingerprint))
+
+    if requests:
+        models.Prediction._get_collection().bulk_write(requests, ordered=True)
+
+
+def predict_all(chunk_size, batch_size):
+    started = time.perf_counter()
+    # one model for the whole run, even if a newer one is activated meanwhile
+    model = get_model()
+    menus = {restaurant.user_id: restaurant.get_all_elements_id()
+             for restaurant in models.Restaurant.objects.only("user_id", "menu.element_id")}
+    fingerprints = {prediction.user_id: prediction.fingerprint
+                    for prediction in models.Prediction.objects.only("user_id", "fingerprint")}
+
+    restaurants = 0
+    unchanged = 0
+    rows = 0
+    batch = []
+    matrices = []
+
+    def flush():
+        if not batch:
+            return
+        predicted = model.predict(np.vstack(matrices), batch_size=batch_size, verbose=0)
+        _write_predictions(batch, predicted)
+        batch.clear()
+        matrices.clear()
+
+    for orders in models.iter_all_orders():
+        if orders.user_id not in menus:
+            continue
+
+        all_elements = menus[orders.user_id]
+        today, history = models.forecast_inputs(orders, all_elements)
+        if today is None:
+            continue
+
+        fingerprint = models.forecast_fingerprint(today, history, 1, model.version)
+        if fingerprint == fingerprints.get(orders.user_id):
+            unchanged += 1
+            continue
+
+        _, element_rows, matrix = features.build_feature_matrix(*history, today, today, model.encoding)
+        if len(element_rows) == 0:
+            continue
+
+        batch.append((orders.user_id, today, [all_elements[i] for i in element_rows], fingerprint))
+        matrices.append(matrix)
+        restaurants += 1
+        rows += len(element_rows)
+
+        if len(batch) >= chunk_size:
+            flush()
+
+    flush()
+
+    elapsed = time.perf_counter() - started
+    print(f"predicted {restaurants} restaurants ({rows} rows) in {elapsed:.2f}s: "
+          f"{restaurants / elapsed:.1f} restaurants/s, {rows / elapsed:.1f} rows/s; {unchanged} unchanged since their last forecast")
+
+
+def migrate_orders():
+    models.DailyOrder.ensure_indexes()
+    collection = models.DailyOrder._get_collection()
+
+    restaurants = 0
+    days = 0
+    for orders in models.Orders.objects:
+        requests = []
+        for order in orders.orders:
+            daily = models.DailyOrder(user_id=orders.user_id, date=order.date, sales=order.sales).to_mongo()
+            requests.append(ReplaceOne({"user_id": daily["user_id"], "date": daily["date"]}, daily, upsert=True))
+
+        if requests:
+            collection.bulk_write(requests, ordered=False)
+        restaurants += 1
+        days += len(requests)
+
+    print(f"migrated {restaurants} restaurants ({days} days) to daily order documents")
+
+
+# restaurants whose rollups are already built are skipped unless everything is rebuilt, so the release step stays cheap
+def rebuild_rollups(everything=False):
+    started = time.perf_counter()
+    built = set() if everything else models.built_rollups()
+    restaurants = 0
+    skipped = 0
+    for orders in models.iter_all_orders(history=False):
+        if orders.user_id in built:
+            skipped += 1
+            continue
+        orders.rebuild_rollups()
+        restaurants += 1
+
+    print(f"rebuilt sales rollups for {restaurants} restaurants in {time.perf_counter() - started:.2f}s, "
+          f"{skipped} already built")
+
+
+def ensure_indexes():
+    failed = 0
+    for document in models.INDEXED_DOCUMENTS:
+        name = document._get_collection_name()
+        try:
+            document.ensure_indexes()
+        except OperationFailure as e:
+            # e.g. duplicate user_id rows under a unique index; the rest still get built
+            failed += 1
+            print(f"{name}: could not build the indexes: {e}")
+            continue
+        print(f"{name}: {', '.join(sorted(document._get_collection().index_information()))}")
+
+    if failed:
+        sys.exit(1)
+
+
+# the lookups the app makes on each request, as (name, document, filter or pipeline, sort)
+def _app_queries():
+    user_id = ObjectId()
+    today = datetime.combine(date.today(), datetime.min.time())
+    week_ago = today - timedelta(days=7)
+    return [
+        ("user by id", models.User, {"_id": user_id}, None),
+        ("user by email", models.User, {"email": "explain@example.com"}, None),
+        ("restaurant by user", models.Restaurant, {"user_id": user_id}, None),
+        ("orders by user", models.Orders, {"user_id": user_id}, None),
+        ("orders sales aggregation", models.Orders, [{"$match": {"user_id": user_id}}, {"$unwind": "$orders"}], None),
+        ("daily order by day", models.DailyOrder, {"user_id": user_id, "date": today}, None),
+        ("daily orders by range", models.DailyOrder, {"user_id": user_id, "date": {"$gte": week_ago, "$lte": today}}, [("date", 1)]),
+        ("latest daily order", models.DailyOrder, {"user_id": user_id}, [("date", -1)]),
+        ("daily orders sales aggregation", models.DailyOrder,
+         [{"$match": {"user_id": user_id, "date": {"$ne": None}}}, {"$unwind": "$sales"}], None),
+        ("monthly sales", models.MonthlySales, {"user_id": user_id, "month": {"$gt": week_ago}}, None),
+        ("daily element sales", models.DailyElementSales, {"user_id": user_id, "date": {"$gte": week_ago, "$lte": today}}, None),
+        ("prediction by user", models.Prediction, {"user_id": user_id}, None),
+        ("charity by id", models.Charity, {"_id": user_id}, None),
+        ("charities by location", models.Charity, {"location": "Riyadh"}, None),
+    ]
+
+
+# every plan stage in an explain() result, ignoring the plans the optimizer rejected
+def _plan_stages(explain):
+    stages = []
+    if isinstance(explain, dict):
+        for key, value in explain.items():
+            if key in ("rejectedPlans", "allPlansExecution"):
+                continue
+            if key == "stage" and isinstance(value, str):
+                stages.append(value)
+            else:
+                stages.extend(_plan_stages(value))
+    elif isinstance(explain, list):
+        for value in explain:
+            stages.extend(_plan_stages(value))
+    return stages
+
+
+def explain_queries():
+    scans = 0
+    for name, document, query, sort in _app_queries():
+        collection = document._get_collection()
+        if isinstance(query, list):
+            explain = collection.database.command("aggregate", collection.name, pipeline=query, explain=True)
+        else:
+            cursor = collection.find(query)
+            if sort:
+                cursor = cursor.sort(sort)
+            explain = cursor.explain()
+
+        stages = _plan_stages(explain)
+        flag = "COLLSCAN" if "COLLSCAN" in stages else "ok"
+        scans += flag == "COLLSCAN"
+        print(f"{flag:8} {name:32} {' <- '.join(dict.fromkeys(stages))}")
+
+    if scans:
+        print(f"{scans} queries scan a whole collection; run `python manage.py ensure-indexes`")
+        sys.exit(1)
+
+
+def export_model(model_path, weights_path):
+    from tensorflow import keras
+
+    inference.export_weights(keras.models.load_model(model_path), weights_path)
+    print(f"exported {model_path} to {weights_path}")
+
+
+def _parse_day(value):
+    return datetime.strptime(value, "%Y-%m-%d").date()
+
+
+def run_backtest(csv_paths, user_ids, start, end, batch_days, batch_size):
+    model = get_model()
+    result = backtest.BacktestResult()
+
+    def predict(matrix):
+        return model.predict(matrix, batch_size=batch_size, verbose=0)
+
+    def histories():
+        # exported files need no database, stored restaurants are read with just the lag window in front of --start
+        for path in csv_paths:
+            with open(path, newline="", encoding="utf-8-sig") as file:
+                yield backtest.history_from_csv(file)
+        if user_ids is None:
+            return
+        first = start - timedelta(days=7) if start else None
+        for orders in (models.iter_all_orders() if not user_ids else
+                       (models.load_orders(ObjectId(user_id)) for user_id in user_ids)):
+            yield features.history_from_orders(orders.get_orders(first, end))
+
+    started = time.perf_counter()
+    restaurants = 0
+    for history in histories():
+        backtest.backtest(history, predict, start, end, batch_days, result, model.encoding)
+        restaurants += 1
+
+    print(backtest.report(result, restaurants))
+    print(f"total {time.perf_counter() - started:.2f}s including loading sales")
+
+
+def export_sales(user_id, path):
+    orders = models.load_orders(ObjectId(user_id))
+    with open(path, "w", newline="") as file:
+        backtest.write_csv(orders, file)
+    print(f"exported the sales of {user_id} to {path}")
+
+
+def train_model(buckets, hashes, epochs, batch_size, learning_rate, validation_days, activate, force):
+    started = time.perf_counter()
+    encoding = features.HashedElements(buckets, hashes)
+    network, rows, score = training.train(encoding, epochs, batch_size, learning_rate, validation_days)
+    elapsed = time.perf_counter() - started
+
+    print(f"validation over the last {validation_days} days: {score.days} forecasts, MAE {backtest.format_number(score.mae())}, "
+          f"MAPE {backtest.format_number(score.mape(), '%')}, naive MAE {backtest.format_number(score.naive_mae())}")
+    # a model that does not beat repeating yesterday's sales is stored but not served
+    better = score.days > 0 and score.mae() < score.naive_mae()
+    metadata = {
+        "created": datetime.utcnow(),
+        "encoding": encoding.describe(),
+        "training_rows": rows,
+        "epochs": epochs,
+        "batch_size": batch_size,
+        "learning_rate": learning_rate,
+        "seconds": round(elapsed, 1),
+        "validation": {"days": validation_days, "forecasts": score.days, "mae": score.mae(),
+                       "mape": score.mape(), "naive_mae": score.naive_mae()},
+    }
+    version = model_registry.publish(network.arrays(encoding), metadata, activate and (better or force))
+
+    if model_registry.active_version() == version:
+        print(f"trained on {rows} rows in {elapsed:.1f}s, activated model {version}")
+    else:
+        print(f"trained on {rows} rows in {elapsed:.1f}s, stored model {version} without activating it"
+              + ("" if better else ": it does not beat the naive forecast, use --force to activate it anyway"))
+
+
+def list_models():
+    active = model_registry.active_version()
+    for metadata in model_registry.list_versions():
+        validation = metadata.get("validation", {})
+        print(f"{'*' if metadata['version'] == active else ' '} {metadata['version']}  {metadata['encoding']['encoding']}  "
+              f"{metadata['training_rows']} rows  validation MAE {backtest.format_number(validation.get('mae'))} "
+              f"(naive {backtest.format_number(validation.get('naive_mae'))})")
+    if active is None:
+        print(f"no trained model is active, {model_registry.MODEL_PATH} is used")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    predict_parser = commands.add_parser("predict-all", help="forecast the next day for every restaurant")
+    predict_parser.add_argument("--chunk-size", type=int, default=500, help="restaurants per model call")
+    predict_parser.add_argument("--batch-size", type=int, default=4096, help="rows per forward pass")
+
+    commands.add_parser("migrate-orders", help="copy embedded Orders into one DailyOrder document per day")
+
+    rollups_parser = commands.add_parser("rebuild-rollups", help="build the dashboard sales rollups of restaurants that have none")
+    rollups_parser.add_argument("--all", action="store_true", help="recompute every restaurant's rollups from its stored sales")
+
+    commands.add_parser("ensure-indexes", help="create the indexes declared in the models")
+
+    commands.add_parser("explain-queries", help="explain the app's queries and flag collection scans")
+
+    export_parser = commands.add_parser("export-model", help="write the keras model's weights for the numpy backend")
+    export_parser.add_argument("--model-path", default=model_registry.MODEL_PATH)
+    export_parser.add_argument("--weights-path", default=model_registry.WEIGHTS_PATH)
+
+    backtest_parser = commands.add_parser("backtest", help="replay sales history and score the day-ahead forecasts")
+    backtest_parser.add_argument("--csv", action="append", default=[], help="exported sales file, no database needed")
+    backtest_parser.add_argument("--user-id", action="append", help="restaurant to replay from the database")
+    backtest_parser.add_argument("--all", action="store_true", help="replay every restaurant in the database")
+    backtest_parser.add_argument("--start", type=_parse_day, help="first forecast day (YYYY-MM-DD)")
+    backtest_parser.add_argument("--end", type=_parse_day, help="last forecast day (YYYY-MM-DD)")
+    backtest_parser.add_argument("--batch-days", type=int, default=90, help="days scored per model call")
+    backtest_parser.add_argument("--batch-size", type=int, default=4096, help="rows per forward pass")
+
+    sales_parser = commands.add_parser("export-sales", help="write a restaurant's sales in the upload csv format")
+    sales_parser.add_argument("user_id")
+    sales_parser.add_argument("path")
+
+    train_parser = commands.add_parser("train", help="train a model on every restaurant's sales and add it to the registry")
+    train_parser.add_argument("--buckets", type=int, default=64, help="columns the element ids are hashed into")
+    train_parser.add_argument("--hashes", type=int, default=2, help="columns set per element")
+    train_parser.add_argument("--epochs", type=int, default=20)
+    train_parser.add_argument("--batch-size", type=int, default=256)
+    train_parser.add_argument("--learning-rate", type=float, default=0.001)
+    train_parser.add_argument("--validation-days", type=int, default=28, help="latest days of each restaurant held out")
+    train_parser.add_argument("--no-activate", dest="activate", action="store_false", help="only store the new version")
+    train_parser.add_argument("--force", action="store_true", help="activate even if it does not beat the naive forecast")
+
+    commands.add_parser("list-models", help="list the trained model versions, * marks the active one")
+
+    activate_parser = commands.add_parser("activate-model", help="serve a stored model version, also to roll back")
+    activate_parser.add_argument("version")
+
+    args = parser.parse_args()
+    if args.command == "list-models":
+        list_models()
+        return
+    if args.command == "activate-model":
+        # running processes switch within MODEL_RELOAD_SECONDS
+        model_registry.activate_version(args.version)
+        print(f"activated model {args.version}")
+        return
+    if args.command == "export-model":
+        # needs tensorflow but no database
+        export_model(args.model_path, args.weights_path)
+        return
+    if args.command == "backtest":
+        if not (args.csv or args.user_id or args.all):
+            parser.error("backtest needs --csv, --user-id or --all")
+        user_ids = [] if args.all else args.user_id
+        if user_ids is not None:
+            models.connect_database()
+        run_backtest(args.csv, user_ids, args.start, args.end, args.batch_days, args.batch_size)
+        return
+
+    models.connect_database()
+
+    if args.command == "predict-all":
+        predict_all(args.chunk_size, args.batch_size)
+    elif args.command == "migrate-orders":
+        migrate_orders()
+    elif args.command == "rebuild-rollups":
+        rebuild_rollups(args.all)
+    elif args.command == "ensure-indexes":
+        ensure_indexes()
+    elif args.command == "explain-queries":
+        explain_queries()
+    elif args.command == "export-sales":
+        export_sales(args.user_id, args.path)
+    elif args.command == "train":
+        train_model(args.buckets, args.hashes, args.epochs, args.batch_size, args.learning_rate,
+                    args.validation_days, args.activate, args.force)
+
+
+if __name__ == "__main__":
+    main()
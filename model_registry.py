@@ -0,0 +1,146 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+
+import inference
+
+MODEL_PATH = os.environ.get("MODEL_PATH", "dnn_model")
+# weights exported from MODEL_PATH for the numpy backend (manage.py export-model)
+WEIGHTS_PATH = os.environ.get("WEIGHTS_PATH", MODEL_PATH.rstrip("/\\") + ".npz")
+# "numpy", "keras", or "auto": numpy when exported weights exist, keras otherwise
+INFERENCE_BACKEND = os.environ.get("INFERENCE_BACKEND", "auto")
+
+# retrained models: REGISTRY_PATH/<version>/{weights.npz,metadata.json}, and CURRENT naming the active one.
+# while no version is active the model above is used
+REGISTRY_PATH = os.environ.get("MODEL_REGISTRY", "trained_models")
+CURRENT_FILE = "CURRENT"
+# how often a running process looks for a newly activated version
+MODEL_RELOAD_SECONDS = float(os.environ.get("MODEL_RELOAD_SECONDS", 30))
+
+_model = None
+_version = None
+_active = None
+_checked_at = None
+_lock = threading.Lock()
+
+
+def _version_path(version, name=""):
+    return os.path.join(REGISTRY_PATH, version, name)
+
+
+def active_version():
+    try:
+        with open(os.path.join(REGISTRY_PATH, CURRENT_FILE)) as file:
+            return file.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def _registry_version():
+    global _active, _checked_at
+    now = time.monotonic()
+    if _checked_at is None or now - _checked_at >= MODEL_RELOAD_SECONDS:
+        _active = active_version()
+        _checked_at = now
+    return _active
+
+
+def _load_backend(version):
+    if version != _legacy_version():
+        return inference.NumpyBackend(_version_path(version, "weights.npz"))
+
+    backend = INFERENCE_BACKEND
+    if backend == "auto":
+        backend = "numpy" if os.path.exists(WEIGHTS_PATH) else "keras"
+
+    if backend == "numpy":
+        return inference.NumpyBackend(WEIGHTS_PATH)
+    if backend == "keras":
+        return inference.KerasBackend(MODEL_PATH)
+    raise ValueError(f"unknown INFERENCE_BACKEND {backend!r}")
+
+
+# the active model, reloaded once another version has been activated
+def get_model():
+    # the keras backend only imports tensorflow in the first process that actually predicts
+    global _model
+    version = model_version()
+    if _model is None or _model.version != version:
+        with _lock:
+            if _model is None or _model.version != version:
+                model = _load_backend(version)
+                model.version = version
+                _model = model
+    return _model
+
+
+def warm_up():
+    model = get_model()
+    model.predict(np.zeros((1, model.encoding.feature_count), dtype=np.float32), verbose=0)
+
+
+# content hash of the exported model (and its numpy weights), so forecasts made by an older export are never reused
+def _legacy_version():
+    global _version
+    if _version is None:
+        paths = [os.path.join(root, name) for root, _, files in sorted(os.walk(MODEL_PATH)) for name in sorted(files)]
+        if os.path.exists(WEIGHTS_PATH):
+            paths.append(WEIGHTS_PATH)
+
+        digest = hashlib.sha256()
+        for path in paths:
+            digest.update(os.path.relpath(path, MODEL_PATH).encode())
+            with open(path, "rb") as file:
+                digest.update(file.read())
+        _version = digest.hexdigest()[:16]
+    return _version
+
+
+# the version new forecasts are made (and fingerprinted) with; does not load the model
+def model_version():
+    return _registry_version() or _legacy_version()
+
+
+# stores a trained model as a new version and, unless told otherwise, makes it the active one
+def publish(arrays, metadata, activate=True):
+    os.makedirs(REGISTRY_PATH, exist_ok=True)
+    digest = hashlib.sha256(b"".join(np.ascontiguousarray(arrays[key]).tobytes() for key in sorted(arrays)))
+    version = f"{datetime.utcnow():%Y%m%d-%H%M%S}-{digest.hexdigest()[:8]}"
+
+    os.makedirs(_version_path(version))
+    np.savez(_version_path(version, "weights.npz"), **arrays)
+    with open(_version_path(version, "metadata.json"), "w") as file:
+        json.dump(dict(metadata, version=version), file, indent=2, default=str)
+
+    if activate:
+        activate_version(version)
+    return version
+
+
+def activate_version(version):
+    if not os.path.exists(_version_path(version, "weights.npz")):
+        raise ValueError(f"no model version {version!r} in {REGISTRY_PATH}")
+
+    # replaced in one step, so a process reading CURRENT never sees a partial name
+    current = os.path.join(REGISTRY_PATH, CURRENT_FILE)
+    with open(current + ".tmp", "w") as file:
+        file.write(version)
+    os.replace(current + ".tmp", current)
+
+
+def list_versions():
+    if not os.path.isdir(REGISTRY_PATH):
+        return []
+
+    versions = []
+    for version in sorted(os.listdir(REGISTRY_PATH)):
+        path = _version_path(version, "metadata.json")
+        if os.path.exists(path):
+            with open(path) as file:
+                versions.append(json.load(file))
+    return versions
@@ -1,51 +1,19 @@
-from datetime import date, timedelta, datetime
-from mongoengine import Document, StringField, ListField, FloatField, DateField, DateTimeField,EmbeddedDocumentField, EmbeddedDocument, ObjectIdField
-from tensorflow import keras
-
-model = keras.models.load_model("dnn_model")
-
-holidays = [
-    {"start": "21/09/2021", "end": "22/09/2021"},
-    {"start": "17/10/2021", "end": "18/10/2021"},
-    {"start": "04/11/2021", "end": "04/11/2021"},
-    {"start": "25/12/2021", "end": "05/12/2021"},
-    {"start": "06/01/2022", "end": "15/01/2022"},
-    {"start": "02/02/2022", "end": "03/02/2022"},
-    {"start": "23/02/2022", "end": "24/02/2022"},
-    {"start": "10/03/2022", "end": "19/03/2022"},
-    {"start": "25/04/2022", "end": "07/05/2022"},
-    {"start": "16/06/2022", "end": "27/08/2022"},
-    {"start": "21/09/2022", "end": "22/09/2022"},
-    {"start": "10/11/2022", "end": "11/11/2022"},
-    {"start": "24/11/2022", "end": "03/12/2022"},
-    {"start": "18/12/2022", "end": "18/12/2022"},
-    {"start": "15/01/2023", "end": "16/01/2023"},
-    {"start": "22/02/2023", "end": "23/02/2023"},
-    {"start": "02/03/2023", "end": "12/03/2023"},
-    {"start": "13/04/2023", "end": "25/04/2023"},
-    {"start": "28/05/2023", "end": "29/05/2023"},
-    {"start": "22/06/2023", "end": "21/08/2023"},
-]
-
-element_ids = {
-    "sk-0003": 4,
-    "sk-0004": 5,
-    "sk-0005": 6,
-    "sk-0009": 7,
-    "sk-0012": 8,
-    "sk-0015": 9,
-    "sk-0016": 10,
-    "sk-0017": 11,
-    "sk-0195": 12,
-    "sk-0602": 13
-}
-
-
-def _is_holiday(time):
-    for holiday in holidays:
-        if datetime.strptime(holiday["start"], "%d/%m/%Y").date() <= time <= datetime.strptime(holiday["end"], "%d/%m/%Y").date():
-            return 1
-    return 0
+import hashlib
+import heapq
+import os
+from datetime import date, datetime, timedelta
+from bson import ObjectId
+from pymongo import DeleteOne, UpdateOne
+from pymongo.errors import DuplicateKeyError
+from mongoengine import connect, Document, StringField, ListField, FloatField, DateField, DateTimeField,EmbeddedDocumentField, EmbeddedDocument, ObjectIdField
+import numpy as np
+from model_registry import get_model, model_version
+import features
+
+
+def connect_database():
+    connect(db='GraduationProject', host=os.environ.get("CONNECTION_URL"))
+
 
 class User(Document):
     first_name = StringField()
@@ -56,6 +24,8 @@ class User(Document):
     phone = StringField()
     created_at = DateTimeField()
 
+    meta = {"auto_create_index": False}
+
     def is_admin(self):
         return self.type.lower() == "admin"
 
@@ -80,7 +50,6 @@ class Element(EmbeddedDocument):
         ingredient = Ingredient(name=name, quantity=quantity, unit=unit)
 
         self.ingredients.append(ingredient)
-        self._instance.save()
         return True
 
     def modify_ingredient(self, number, name, quantity, unit):
@@ -93,8 +62,6 @@ class Element(EmbeddedDocument):
         ingredient.unit = unit
         ingredient.quantity = quantity
 
-        self._instance.save()
-
         return True
 
     def remove_ingredient(self, number):
@@ -105,7 +72,6 @@ class Element(EmbeddedDocument):
 
         self.ingredients.remove(ingredient)
 
-        self._instance.save()
         return True
 
 
@@ -114,37 +80,54 @@ class Restaurant(Document):
     location = StringField()
     menu = ListField(EmbeddedDocumentField(Element))
 
-    def add_element(self, element_id, name):
-        for element in self.menu:
-            if element.element_id == element_id:
-                return False
+    meta = {"auto_create_index": False, "indexes": [{"fields": ["user_id"], "unique": True}]}
+
+    # one conditional update on this restaurant; False when the condition no longer holds
+    def _update(self, query, update, array_filters=None):
+        query = dict(query, _id=self.id)
+        return Restaurant._get_collection().update_one(query, update, array_filters=array_filters).matched_count == 1
+
+    # the local copy mirrors a write that is already stored, so save() must not send it again
+    def _mirrored(self):
+        self._clear_changed_fields()
+        return True
 
+    def add_element(self, element_id, name):
         element = Element(element_id=element_id, name=name)
+        element.validate()
 
-        self.menu.append(element)
+        if not self._update({"menu.element_id": {"$ne": element_id}}, {"$push": {"menu": element.to_mongo()}}):
+            return False
 
-        self.save()
-        return True
+        self.menu.append(element)
+        return self._mirrored()
 
     def modify_element(self, element_id_before,element_id, name=None):
+        if not name:
+            return self.get_element(element_id_before) is not None
+
+        ids = [{"menu.element_id": element_id_before}]
+        if element_id != element_id_before:
+            ids.append({"menu.element_id": {"$ne": element_id}})
+        if not self._update({"$and": ids},
+                            {"$set": {"menu.$[element].element_id": element_id, "menu.$[element].name": name}},
+                            array_filters=[{"element.element_id": element_id_before}]):
+            return False
 
-        for element in self.menu:
-            if element.element_id == element_id_before:
-                if name:
-                    element.element_id = element_id
-                    element.name = name
-                self.save()
-                return True
-
-        return False
+        element = self.get_element(element_id_before)
+        if element is not None:
+            element.element_id = element_id
+            element.name = name
+        return self._mirrored()
 
     def remove_element(self, element_id):
-        for element in self.menu:
-            if element.element_id == element_id:
-                self.menu.remove(element)
-                self.save()
-                return True
-        return False
+        if not self._update({"menu.element_id": element_id}, {"$pull": {"menu": {"element_id": element_id}}}):
+            return False
+
+        element = self.get_element(element_id)
+        if element is not None:
+            self.menu.remove(element)
+        return self._mirrored()
 
     def get_element(self, element_id):
         for element in self.menu:
@@ -159,22 +142,51 @@ class Restaurant(Document):
         return elements
 
     def add_ingredient(self, element_id, name, quantity, unit):
-        for element in self.menu:
-            if element.element_id == element_id:
-                return element.add_ingredient(name, quantity, unit)
-        return False
+        element = self.get_element(element_id)
+        if element is None:
+            return False
+
+        ingredient = Ingredient(name=name, quantity=quantity, unit=unit)
+        ingredient.validate()
+        if not self._update({"menu": {"$elemMatch": {"element_id": element_id, "ingredients.name": {"$ne": name}}}},
+                            {"$push": {"menu.$.ingredients": ingredient.to_mongo()}}):
+            return False
+
+        element.add_ingredient(name, quantity, unit)
+        return self._mirrored()
 
+    # ingredients are addressed by name in the database, so a concurrent removal can't shift the target
     def modify_ingredient(self, element_id, number, name, quantity, unit):
-        for element in self.menu:
-            if element.element_id == element_id:
-                return element.modify_ingredient(number, name, quantity, unit)
-        return False
+        element = self.get_element(element_id)
+        if element is None or number >= len(element.ingredients):
+            return False
+
+        ingredient = Ingredient(name=name, quantity=quantity, unit=unit)
+        ingredient.validate()
+        old_name = element.ingredients[number].name
+        names = [{"ingredients.name": old_name}]
+        if name != old_name:
+            names.append({"ingredients.name": {"$ne": name}})
+        if not self._update({"menu": {"$elemMatch": {"element_id": element_id, "$and": names}}},
+                            {"$set": {"menu.$[element].ingredients.$[ingredient]": ingredient.to_mongo()}},
+                            array_filters=[{"element.element_id": element_id}, {"ingredient.name": old_name}]):
+            return False
+
+        element.modify_ingredient(number, name, quantity, unit)
+        return self._mirrored()
 
     def remove_ingredient(self, element_id, number):
-        for element in self.menu:
-            if element.element_id == element_id:
-                return element.remove_ingredient(number)
-        return False
+        element = self.get_element(element_id)
+        if element is None or number >= len(element.ingredients):
+            return False
+
+        name = element.ingredients[number].name
+        if not self._update({"menu": {"$elemMatch": {"element_id": element_id, "ingredients.name": name}}},
+                            {"$pull": {"menu.$.ingredients": {"name": name}}}):
+            return False
+
+        element.remove_ingredient(number)
+        return self._mirrored()
 
 
 class Sales(EmbeddedDocument):
@@ -182,189 +194,667 @@ class Sales(EmbeddedDocument):
     quantity = FloatField()
 
 
-class Order(EmbeddedDocument):
-    sales = ListField(EmbeddedDocumentField(Sales))
-    date = DateField()
+class SalesList:
+
+    # element_id -> Sales, rebuilt whenever the sales list itself is replaced
+    def _get_sales_index(self):
+        if getattr(self, "_indexed_sales", None) is not self.sales:
+            self._sales_index = {}
+            for sale in self.sales:
+                self._sales_index.setdefault(sale.element_id, sale)
+            self._indexed_sales = self.sales
+        return self._sales_index
 
     def add_sale(self, element_id, quantity):
-        for sale in self.sales:
-            if sale.element_id == element_id:
-                return False
+        index = self._get_sales_index()
+        if element_id in index:
+            return False
 
         element = Sales(element_id=element_id, quantity=quantity)
         self.sales.append(element)
+        index[element_id] = element
 
         return True
 
     def modify_sale(self, element_id, quantity=None):
+        sale = self._get_sales_index().get(element_id)
+        if sale is None:
+            return False
 
-        for sale in self.sales:
-            if sale.element_id == element_id:
-                if quantity:
-                    sale.quantity = quantity
-                return True
-        return False
+        if quantity:
+            sale.quantity = quantity
+        return True
 
     def remove_sale(self, element_id):
-        for sale in self.sales:
-            if sale.element_id == element_id:
-                self.sales.remove(sale)
-                return True
-        return False
+        sale = self._get_sales_index().pop(element_id, None)
+        if sale is None:
+            return False
+
+        self.sales.remove(sale)
+        return True
 
     def get_sale(self, element_id):
-        for sale in self.sales:
-            if sale.element_id == element_id:
-                return sale
-        return None
+        return self._get_sales_index().get(element_id)
 
-    def _is_element_in_sales(self, element_id):
-        for element in self.sales:
-            if element.element_id == element_id:
-                return True
-        return False
 
-    def get_unused_elements(self):
-        user_id = self._instance.user_id
+class Order(SalesList, EmbeddedDocument):
+    sales = ListField(EmbeddedDocumentField(Sales))
+    date = DateField()
 
-        restaurant = Restaurant.objects.get(user_id=user_id)
 
-        elements = []
-        for element in restaurant.menu:
-            if not self._is_element_in_sales(element.element_id):
-                elements.append(element.element_id)
+class DailyOrder(SalesList, Document):
+    user_id = ObjectIdField()
+    date = DateField()
+    sales = ListField(EmbeddedDocumentField(Sales))
+
+    meta = {"auto_create_index": False, "indexes": [{"fields": ["user_id", "date"], "unique": True}]}
+
+
+class MonthlySales(Document):
+    user_id = ObjectIdField()
+    month = DateField()
+    total = FloatField()
+
+    meta = {"auto_create_index": False, "indexes": [{"fields": ["user_id", "month"], "unique": True}]}
+
+
+class DailyElementSales(Document):
+    user_id = ObjectIdField()
+    date = DateField()
+    element_id = StringField()
+    quantity = FloatField()
+
+    meta = {"auto_create_index": False, "indexes": [{"fields": ["user_id", "date", "element_id"], "unique": True}]}
+
+
+# marks a restaurant whose rollups cover all of its stored sales: set by a finished rebuild, or when the
+# restaurant is created and every sale goes through the rollups from the start
+class SalesRollupState(Document):
+    user_id = ObjectIdField()
+    built_at = DateTimeField()
+
+    meta = {"auto_create_index": False, "indexes": [{"fields": ["user_id"], "unique": True}]}
+
+
+# per-restaurant monthly totals and per-day per-element quantities, kept in step with every sale write
+class SalesRollup:
+
+    def __init__(self, user_id):
+        self.user_id = ObjectId(user_id)
+        self._months = {}
+        self._days = {}
+
+    def record(self, date, element_id, old_quantity, new_quantity):
+        if old_quantity == new_quantity:
+            return
+
+        month = _to_datetime(date.replace(day=1))
+        self._months[month] = self._months.get(month, 0) + (new_quantity or 0) - (old_quantity or 0)
+        self._days[(_to_datetime(date), element_id)] = new_quantity
+
+    def flush(self):
+        months = [UpdateOne({"user_id": self.user_id, "month": month}, {"$inc": {"total": delta}}, upsert=True)
+                  for month, delta in self._months.items()]
+        days = []
+        for (time, element_id), quantity in self._days.items():
+            key = {"user_id": self.user_id, "date": time, "element_id": element_id}
+            if quantity is None:
+                days.append(DeleteOne(key))
+            else:
+                days.append(UpdateOne(key, {"$set": {"quantity": quantity}}, upsert=True))
+
+        if months:
+            MonthlySales._get_collection().bulk_write(months, ordered=False)
+        if days:
+            DailyElementSales._get_collection().bulk_write(days, ordered=False)
+        self._months.clear()
+        self._days.clear()
+
+    def clear(self):
+        MonthlySales.objects(user_id=self.user_id).delete()
+        DailyElementSales.objects(user_id=self.user_id).delete()
+        self._months.clear()
+        self._days.clear()
+
+    def delete(self):
+        self.clear()
+        SalesRollupState.objects(user_id=self.user_id).delete()
+
+    def mark_built(self):
+        SalesRollupState._get_collection().update_one({"user_id": self.user_id},
+                                                      {"$set": {"built_at": datetime.utcnow()}}, upsert=True)
+
+    # recomputes every row from the stored sales with upserts, deletes the rows no sale backs any more,
+    # and marks the restaurant built once both collections are written
+    def rebuild(self, orders):
+        every_day = {"$ne": None}
+
+        monthly = orders._aggregate_sales(every_day, [
+            {"$group": {"_id": {"year": {"$year": "$date"}, "month": {"$month": "$date"}}, "total": {"$sum": "$quantity"}}}
+        ])
+        self._replace(MonthlySales, ("month",),
+                      {(datetime(month["_id"]["year"], month["_id"]["month"], 1),): {"total": month["total"]} for month in monthly})
+
+        daily = orders._aggregate_sales(every_day, [
+            {"$group": {"_id": {"date": "$date", "element_id": "$element_id"}, "quantity": {"$sum": "$quantity"}}}
+        ])
+        self._replace(DailyElementSales, ("date", "element_id"),
+                      {(day["_id"]["date"], day["_id"]["element_id"]): {"quantity": day["quantity"]} for day in daily})
+
+        self.mark_built()
+
+    def _replace(self, document, fields, rows):
+        collection = document._get_collection()
+        stored = {tuple(row[field] for field in fields)
+                  for row in collection.find({"user_id": self.user_id}, {field: 1 for field in fields})}
+
+        requests = [UpdateOne(dict(zip(fields, key), user_id=self.user_id), {"$set": values}, upsert=True)
+                    for key, values in rows.items()]
+        requests += [DeleteOne(dict(zip(fields, key), user_id=self.user_id)) for key in stored - set(rows)]
+        if requests:
+            collection.bulk_write(requests, ordered=False)
+
+    def get_monthly_sales(self):
+        return _monthly_sales({"_id": month.month.month, "total": month.total}
+                              for month in MonthlySales.objects(user_id=self.user_id, month__gt=_monthly_starting_date()))
+
+    # the n best selling elements over the last `days` days, with one quantity slot per day (oldest first)
+    def get_top_sales(self, n=5, days=7):
+        time = date.today()
+        rows = DailyElementSales.objects(user_id=self.user_id, date__gte=time - timedelta(days=days),
+                                         date__lte=time - timedelta(days=1)).only("date", "element_id", "quantity")
+
+        totals = {}
+        for row in rows:
+            element = totals.get(row.element_id)
+            if element is None:
+                element = totals[row.element_id] = {"element_id": row.element_id, "sales": [0] * days, "total": 0}
+            element["sales"][days - (time - row.date).days] = row.quantity
+            element["total"] += row.quantity
+
+        return heapq.nlargest(n, totals.values(), key=lambda element: element["total"])
+
+    def get_most_sales_in_week(self, n=5, days=7):
+        time = date.today()
+        labels = [(time - timedelta(days=i)).strftime("%m/%d") for i in range(days, 0, -1)]
+        return labels, self.get_top_sales(n, days)
+
+
+class RollupMixin:
+
+    def _get_rollup(self):
+        if getattr(self, "_rollup", None) is None:
+            self._rollup = SalesRollup(self.user_id)
+        return self._rollup
+
+    @staticmethod
+    def _get_quantity(order, element_id):
+        sale = order.get_sale(element_id) if order is not None else None
+        return sale.quantity if sale is not None else None
+
+    def _record_sale(self, date, element_id, old_quantity, order):
+        self._get_rollup().record(date, element_id, old_quantity, self._get_quantity(order, element_id))
+
+    def rebuild_rollups(self):
+        self._get_rollup().rebuild(self)
+
+    def get_top_sales(self, n=5, days=7):
+        return self._get_rollup().get_top_sales(n, days)
+
+    def get_most_sales_in_week(self, n=5, days=7):
+        return self._get_rollup().get_most_sales_in_week(n, days)
+
+    def get_monthly_sales(self):
+        return self._get_rollup().get_monthly_sales()
+
+
+def _to_datetime(time):
+    return datetime(time.year, time.month, time.day)
+
+
+# quantity of element_id in a raw sales list read straight from mongo
+def _stored_quantity(sales, element_id):
+    for sale in sales:
+        if sale["element_id"] == element_id:
+            return sale["quantity"]
+    return None
 
-        return elements
 
+def _monthly_starting_date():
+    current_month = date.today().month
+    starting_date = date(year=date.today().year - 1, month= current_month, day=28)
 
-class Orders(Document):
+    while (starting_date + timedelta(days=1)).month == current_month:
+        starting_date = starting_date + timedelta(days=1)
+
+    return starting_date
+
+
+def _monthly_sales(monthly_totals):
+    months = ["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"]
+
+    # offset
+    current_month = date.today().month
+
+    labels = []
+    sales = [0 for _ in range(12)]
+    for i in range(12):
+        labels.append(months[(current_month + i) % 12])
+
+    for month in monthly_totals:
+        sales[month["_id"] - current_month - 1] += month["total"]
+
+    return labels, sales
+
+
+class Orders(RollupMixin, Document):
     user_id = ObjectIdField()
     orders = ListField(EmbeddedDocumentField(Order))
 
+    meta = {"auto_create_index": False, "indexes": [{"fields": ["user_id"], "unique": True}]}
+
+    # date -> Order, rebuilt whenever the orders list itself is replaced
+    def _get_order_index(self):
+        if getattr(self, "_indexed_orders", None) is not self.orders:
+            self._order_index = {}
+            for order in self.orders:
+                self._order_index.setdefault(order.date, order)
+            self._indexed_orders = self.orders
+        return self._order_index
+
     def add_order(self, date):
-        for order in self.orders:
-            if order.date == date:
-                return False
+        index = self._get_order_index()
+        if date in index:
+            return False
 
         order = Order(date=date)
 
         self.orders.append(order)
+        index[date] = order
 
         return order
 
     def add_sale_to_order(self, date, element_id, quantity):
+        time = _to_datetime(date)
+        sale = Sales(element_id=element_id, quantity=quantity)
+        sale.validate()
+        collection = Orders._get_collection()
+
+        # push into the day's order unless the element is already there, otherwise start the day;
+        # a second round covers another request creating the day in between
+        for _ in range(2):
+            if collection.update_one({"_id": self.id, "orders": {"$elemMatch": {"date": time, "sales.element_id": {"$ne": element_id}}}},
+                                     {"$push": {"orders.$.sales": sale.to_mongo()}}).matched_count:
+                break
+            if collection.update_one({"_id": self.id, "orders.date": {"$ne": time}},
+                                     {"$push": {"orders": {"date": time, "sales": [sale.to_mongo()]}}}).matched_count:
+                break
+        else:
+            return False
 
-        for order in self.orders:
-            if order.date == date:
-                if order.add_sale(element_id, quantity):
-                    self.save()
-                    return True
-                return False
-
-        order = self.add_order(date)
+        order = self.get_order(date) or self.add_order(date)
         order.add_sale(element_id, quantity)
-        self.save()
+        self._clear_changed_fields()
 
+        rollup = self._get_rollup()
+        rollup.record(date, element_id, None, quantity)
+        rollup.flush()
         return True
 
     def add_or_update_sale_to_order(self, date, element_id, quantity):
 
-        for order in self.orders:
-            if order.date == date:
-                if not order.add_sale(element_id, quantity):
-                    order.modify_sale(element_id, quantity)
+        order = self.get_order(date) or self.add_order(date)
+        old_quantity = self._get_quantity(order, element_id)
+        if not order.add_sale(element_id, quantity):
+            order.modify_sale(element_id, quantity)
+        self._record_sale(date, element_id, old_quantity, order)
 
+        return True
 
-                return True
 
-        order = self.add_order(date)
-        order.add_sale(element_id, quantity)
+    def modify_order(self, date, element_id, quantity):
+        if date is None:
+            return False
+        if not quantity:
+            return _stored_quantity(self.get_day_sales(date) or [], element_id) is not None
+
+        time = _to_datetime(date)
+        Sales(element_id=element_id, quantity=quantity).validate()
+        before = Orders._get_collection().find_one_and_update(
+            {"_id": self.id, "orders": {"$elemMatch": {"date": time, "sales.element_id": element_id}}},
+            {"$set": {"orders.$[order].sales.$[sale].quantity": quantity}},
+            projection={"orders": {"$elemMatch": {"date": time}}},
+            array_filters=[{"order.date": time}, {"sale.element_id": element_id}])
+        if before is None:
+            return False
 
+        order = self.get_order(date)
+        if order is not None:
+            order.modify_sale(element_id, quantity)
+            self._clear_changed_fields()
+
+        rollup = self._get_rollup()
+        rollup.record(date, element_id, _stored_quantity(before["orders"][0]["sales"], element_id), quantity)
+        rollup.flush()
         return True
 
+    def remove_sale_from_order(self, date, element_id):
+        if date is None:
+            return False
+        time = _to_datetime(date)
+        collection = Orders._get_collection()
+        before = collection.find_one_and_update(
+            {"_id": self.id, "orders": {"$elemMatch": {"date": time, "sales.element_id": element_id}}},
+            {"$pull": {"orders.$.sales": {"element_id": element_id}}},
+            projection={"orders": {"$elemMatch": {"date": time}}})
+        if before is None:
+            return False
 
-    def modify_order(self, date, element_id, quantity):
+        # drop the day once its last sale is gone
+        collection.update_one({"_id": self.id}, {"$pull": {"orders": {"date": time, "sales": {"$size": 0}}}})
 
-        for order in self.orders:
-            if order.date == date:
-                if order.modify_sale(element_id, quantity):
-                    self.save()
-                    return True
+        order = self.get_order(date)
+        if order is not None and order.remove_sale(element_id):
+            if len(order.sales) == 0:
+                self.orders.remove(order)
+                del self._get_order_index()[date]
+            self._clear_changed_fields()
 
-        return False
+        rollup = self._get_rollup()
+        rollup.record(date, element_id, _stored_quantity(before["orders"][0]["sales"], element_id), None)
+        rollup.flush()
+        return True
+
+    def get_order(self, time:date):
+        return self._get_order_index().get(time)
+
+    # the day's sales as raw {element_id, quantity} dicts straight from mongo, None if the day has no order
+    def get_day_sales(self, time:date):
+        document = Orders._get_collection().find_one({"user_id": self.user_id},
+                                                     {"orders": {"$elemMatch": {"date": _to_datetime(time)}}})
+        if document is None or not document.get("orders"):
+            return None
+        return document["orders"][0].get("sales", [])
+
+    def get_orders(self, start=None, end=None):
+        return [order for order in self.orders
+                if (not start or order.date >= start) and (not end or order.date <= end)]
+
+    def get_latest_date(self):
+        if len(self.orders) == 0:
+            return None
+        return max(order.date for order in self.orders)
+
+    # flattens the embedded orders in [date_range] into {date, element_id, quantity} rows
+    def _aggregate_sales(self, date_range, stages):
+        return list(Orders._get_collection().aggregate([
+            {"$match": {"user_id": self.user_id}},
+            {"$unwind": "$orders"},
+            {"$match": {"orders.date": date_range}},
+            {"$unwind": "$orders.sales"},
+            {"$project": {"date": "$orders.date", "element_id": "$orders.sales.element_id",
+                          "quantity": "$orders.sales.quantity"}}
+        ] + stages))
+
+    def save(self, *args, **kwargs):
+        result = super().save(*args, **kwargs)
+        self._get_rollup().flush()
+        return result
+
+    def clear(self):
+        self.orders = []
+        self.save()
+        self._get_rollup().clear()
+
+    def delete(self, *args, **kwargs):
+        super().delete(*args, **kwargs)
+        self._get_rollup().delete()
+
+
+# one DailyOrder document per (restaurant, day); same interface as Orders
+class DailyOrders(RollupMixin):
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self._pending = {}
+
+    def _query(self):
+        return DailyOrder.objects(user_id=self.user_id)
+
+    def add_order(self, date):
+        if self.get_order(date):
+            return False
+
+        order = DailyOrder(user_id=self.user_id, date=date)
+        self._pending[date] = order
+
+        return order
+
+    def _day(self, date):
+        return {"user_id": ObjectId(self.user_id), "date": _to_datetime(date)}
+
+    def add_sale_to_order(self, date, element_id, quantity):
+        sale = Sales(element_id=element_id, quantity=quantity)
+        sale.validate()
+        try:
+            # upserts the day; when the day exists with this element the upsert hits the unique index
+            DailyOrder._get_collection().update_one(dict(self._day(date), **{"sales.element_id": {"$ne": element_id}}),
+                                                    {"$push": {"sales": sale.to_mongo()}}, upsert=True)
+        except DuplicateKeyError:
+            return False
+
+        rollup = self._get_rollup()
+        rollup.record(date, element_id, None, quantity)
+        rollup.flush()
+        return True
+
+    def add_or_update_sale_to_order(self, date, element_id, quantity):
+        order = self.get_order(date) or self.add_order(date)
+        self._pending[date] = order
+
+        old_quantity = self._get_quantity(order, element_id)
+        if not order.add_sale(element_id, quantity):
+            order.modify_sale(element_id, quantity)
+        self._record_sale(date, element_id, old_quantity, order)
+
+        return True
+
+    def modify_order(self, date, element_id, quantity):
+        if date is None:
+            return False
+        if not quantity:
+            return _stored_quantity(self.get_day_sales(date) or [], element_id) is not None
+
+        Sales(element_id=element_id, quantity=quantity).validate()
+        before = DailyOrder._get_collection().find_one_and_update(
+            dict(self._day(date), **{"sales.element_id": element_id}),
+            {"$set": {"sales.$.quantity": quantity}},
+            projection={"sales": {"$elemMatch": {"element_id": element_id}}})
+        if before is None:
+            return False
+
+        rollup = self._get_rollup()
+        rollup.record(date, element_id, _stored_quantity(before["sales"], element_id), quantity)
+        rollup.flush()
+        return True
 
     def remove_sale_from_order(self, date, element_id):
+        if date is None:
+            return False
+        collection = DailyOrder._get_collection()
+        before = collection.find_one_and_update(
+            dict(self._day(date), **{"sales.element_id": element_id}),
+            {"$pull": {"sales": {"element_id": element_id}}},
+            projection={"sales": {"$elemMatch": {"element_id": element_id}}})
+        if before is None:
+            return False
 
-        for order in self.orders:
-            if order.date == date:
-                if order.remove_sale(element_id):
-                    if len(order.sales) == 0:
-                        self.orders.remove(order)
-                    self.save()
-                    return True
+        collection.delete_one(dict(self._day(date), sales={"$size": 0}))
 
-        return False
+        rollup = self._get_rollup()
+        rollup.record(date, element_id, _stored_quantity(before["sales"], element_id), None)
+        rollup.flush()
+        return True
+
+    def get_day_sales(self, time:date):
+        document = DailyOrder._get_collection().find_one(self._day(time), {"sales": 1})
+        if document is None:
+            return None
+        return document.get("sales", [])
 
     def get_order(self, time:date):
-        for order in self.orders:
-            if order.date == time:
-                return order
-        return None
+        if time in self._pending:
+            return self._pending[time]
+        return self._query().filter(date=time).first()
+
+    def get_orders(self, start=None, end=None):
+        query = self._query()
+        if start:
+            query = query.filter(date__gte=start)
+        if end:
+            query = query.filter(date__lte=end)
+        return list(query.order_by("date"))
+
+    @property
+    def orders(self):
+        return self.get_orders()
+
+    def get_latest_date(self):
+        latest = self._query().only("date").order_by("-date").first()
+        return latest.date if latest else None
+
+    def _aggregate_sales(self, date_range, stages):
+        return list(DailyOrder._get_collection().aggregate([
+            {"$match": {"user_id": ObjectId(self.user_id), "date": date_range}},
+            {"$unwind": "$sales"},
+            {"$project": {"date": 1, "element_id": "$sales.element_id", "quantity": "$sales.quantity"}}
+        ] + stages))
 
-    def _is_added_to_sales(self, element_id, sales):
-        for sale in sales:
-            if sale["element_id"] == element_id:
-                return True
 
-        return False
+    def save(self):
+        for order in self._pending.values():
+            order.save()
+        self._pending.clear()
+        self._get_rollup().flush()
 
-    def get_most_sales_in_week(self):
-        time = date.today()
-        sales = []
-        for order in self.orders:
-            if time - timedelta(days=1) >= order.date >= time - timedelta(days=7):
-                day = 6 - (time - order.date).days
-                for sale in order.sales:
-                    if not self._is_added_to_sales(sale.element_id, sales):
-                        sales.append({"element_id": sale.element_id, "sales": [0, 0, 0, 0, 0, 0, 0], "total": 0})
+    def clear(self):
+        self._query().delete()
+        self._pending.clear()
+        self._get_rollup().clear()
 
-                    for added_sales in sales:
-                        if added_sales["element_id"] == sale.element_id:
-                            added_sales["sales"][day] = sale.quantity
-                            added_sales["total"] += sale.quantity
-                            break
+    def delete(self):
+        self._query().delete()
+        self._pending.clear()
+        self._get_rollup().delete()
 
-        sales.sort(key= lambda sale: sale["total"], reverse=True)
-        labels = [(time - timedelta(days=i + 1)).strftime("%m/%d") for i in range(6, -1, -1)]
-        return labels, sales[:5]
 
+SALES_STORAGE = os.environ.get("SALES_STORAGE", "embedded")
 
-    def get_monthly_sales(self):
-        months = ["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"]
 
-        # offset
-        current_month = date.today().month
+# history=False skips loading the embedded orders, for callers that only aggregate
+def load_orders(user_id, history=True):
+    if SALES_STORAGE == "daily":
+        return DailyOrders(user_id)
+    if not history:
+        return Orders.objects.only("user_id").get(user_id=user_id)
+    return Orders.objects.get(user_id=user_id)
+
+
+# read-only orders of the last `days` recorded days, filtered by the server instead of loading the whole
+# embedded history; never save the result, it would drop every older order
+def load_recent_orders(user_id, days=7):
+    if SALES_STORAGE == "daily":
+        return DailyOrders(user_id)
+
+    since = {"$subtract": [{"$max": "$orders.date"}, days * 24 * 60 * 60 * 1000]}
+    recent = next(Orders._get_collection().aggregate([
+        {"$match": {"user_id": user_id}},
+        {"$project": {"user_id": 1, "orders": {"$let": {"vars": {"since": since}, "in": {
+            "$filter": {"input": "$orders", "as": "order", "cond": {"$gt": ["$$order.date", "$$since"]}}}}}}},
+    ]), None)
+    if recent is None:
+        raise Orders.DoesNotExist(f"no orders for {user_id}")
+    return Orders._from_son(recent)
+
+
+def create_orders(user_id):
+    if SALES_STORAGE != "daily":
+        Orders(user_id=user_id, orders=[]).save()
+    # a new restaurant has no sales the rollups missed
+    SalesRollup(user_id).mark_built()
+
+
+# user ids whose rollups need no rebuild
+def built_rollups():
+    return set(SalesRollupState.objects.distinct("user_id"))
+
+
+def iter_all_orders(history=True):
+    if SALES_STORAGE == "daily":
+        for user_id in DailyOrder.objects.distinct("user_id"):
+            yield DailyOrders(user_id)
+    elif not history:
+        yield from Orders.objects.only("user_id")
+    else:
+        yield from Orders.objects
+
+
+# the day after the latest sale and the week of sales its lag features come from
+def forecast_inputs(orders, all_elements):
+    latest_date = orders.get_latest_date()
+    if latest_date is None:
+        return None, None
+    today = latest_date + timedelta(days=1)
+
+    return today, features.history_from_orders(orders.get_orders(today - timedelta(days=7), latest_date), all_elements)
 
-        labels = []
-        sales = [0 for _ in range(12)]
-        for i in range(12):
-            labels.append(months[(current_month + i) % 12])
-        starting_date = date(year=date.today().year - 1, month= current_month, day=28)
 
-        while (starting_date + timedelta(days=1)).month == current_month:
-            starting_date = starting_date + timedelta(days=1)
+# identifies everything a forecast depends on: the lag window's sales, the menu, the target days and the model
+def forecast_fingerprint(today, history, days, version=None):
+    dates, elements, quantities, vocabulary = history
+    order = np.lexsort((elements, dates))
+    digest = hashlib.sha256(f"{version or model_version()}|{today}|{days}|{','.join(vocabulary)}".encode())
+    for column in (dates[order], elements[order], quantities[order]):
+        digest.update(column.tobytes())
+    return digest.hexdigest()
 
-        for order in self.orders:
-            if order.date > starting_date:
-                for sale in order.sales:
-                    sales[order.date.month - current_month - 1] += sale.quantity
 
-        return labels, sales
+# days forecast by one prediction run, unless the request asks for another horizon
+FORECAST_DAYS = int(os.environ.get("FORECAST_DAYS", 1))
+MAX_FORECAST_DAYS = 14
+
+
+def forecast_days(days=None):
+    return min(days or FORECAST_DAYS, MAX_FORECAST_DAYS)
+
+
+def forecast_orders(today, history, days, predict, encoding=features.ONE_HOT):
+    vocabulary = history[3]
+    return [Prediction.make_order(day.item(), [vocabulary[i] for i in rows], predicted[:, None])
+            for day, rows, predicted in features.forecast(*history, today, days, predict, encoding)]
+
+
+# True when the stored forecast was made from the current sales, menu and model, so predicting again is a no-op
+def forecast_is_current(user_id, days=None):
+    prediction = Prediction.objects(user_id=user_id).only("fingerprint", "horizon_start", "horizon_end", "orders.date").first()
+    restaurant = Restaurant.objects(user_id=user_id).only("menu.element_id").first()
+    if prediction is None or not prediction.fingerprint or not prediction.has_horizon() or restaurant is None:
+        return False
+
+    # the fingerprint only needs the lag window that forecast_inputs reads
+    today, history = forecast_inputs(load_recent_orders(user_id), restaurant.get_all_elements_id())
+    return today is not None and forecast_fingerprint(today, history, forecast_days(days)) == prediction.fingerprint
 
 
 class Prediction(Document):
     user_id = ObjectIdField()
     orders = ListField(EmbeddedDocumentField(Order))
+    # first and last day of the latest forecast run, and the forecast_fingerprint of its inputs
+    horizon_start = DateField()
+    horizon_end = DateField()
+    fingerprint = StringField()
+
+    meta = {"auto_create_index": False, "indexes": [{"fields": ["user_id"], "unique": True}]}
 
     def get_latest_prediction(self):
         if len(self.orders) == 0:
@@ -372,67 +862,84 @@ class Prediction(Document):
 
         return max(self.orders, key=lambda order: order.date)
 
-    def predict(self):
+    # the days of the latest forecast run, oldest first
+    def get_horizon(self):
+        if self.horizon_start and self.horizon_end:
+            return self.get_predictions(self.horizon_start, self.horizon_end)
+        latest_prediction = self.get_latest_prediction()
+        return [latest_prediction] if latest_prediction else []
 
-        orders = Orders.objects.get(user_id=self.user_id)
+    # every day of the latest forecast run is still stored
+    def has_horizon(self):
+        if not (self.horizon_start and self.horizon_end):
+            return False
+        days = {order.date for order in self.orders}
+        return all(self.horizon_start + timedelta(days=i) in days
+                   for i in range((self.horizon_end - self.horizon_start).days + 1))
+
+    def get_predictions(self, start, end):
+        return sorted((order for order in self.orders if start <= order.date <= end), key=lambda order: order.date)
+
+    @staticmethod
+    def make_order(today, elements, predicted):
+        order = Order(date=today)
+        for row, element in enumerate(elements):
+            order.add_sale(element, float(predicted[row][0]))
+        return order
 
-        latest_order = max(orders.orders, key=lambda order: order.date)
-        restaurant = Restaurant.objects.get(user_id=self.user_id)
-        all_elements = [element.element_id for element in restaurant.menu]
-        last_week = latest_order.date - timedelta(days=6)
-        today = latest_order.date + timedelta(days=1)
+    # replaces any stored forecast for the order's day without rewriting the others
+    @staticmethod
+    def prediction_updates(user_id, order):
+        order = order.to_mongo()
+        return [UpdateOne({"user_id": user_id}, {"$pull": {"orders": {"date": order["date"]}}}, upsert=True),
+                UpdateOne({"user_id": user_id}, {"$push": {"orders": order}})]
 
-        try:
-            last_week_sales = orders.get_order(last_week).sales
-            yesterday_sales = latest_order.sales
-            last_week_ids = [element.element_id for element in last_week_sales]
-            yesterday_ids = [element.element_id for element in yesterday_sales]
-            elements_to_predict = [element_id for element_id in all_elements if element_id in yesterday_ids and element_id in last_week_ids]
+    @staticmethod
+    def horizon_update(user_id, start, end, fingerprint):
+        return UpdateOne({"user_id": user_id}, {"$set": {"horizon_start": _to_datetime(start), "horizon_end": _to_datetime(end),
+                                                         "fingerprint": fingerprint}})
 
-            if len(elements_to_predict) == 0:
-                raise Exception
-            features = [0] * 18
-
-            #weekend
-            features[0] = 1 if 3 <= today.weekday() <= 5 else 0
-
-            #holiday
-            features[1] = _is_holiday(today)
-
-            #seasons
-            year = today.year
-            if date(year=year, month=9, day=23) <= today <= date(year=year, month=12, day=20):
-                features[14] = 1
-            elif date(year=year, month=3, day=21) <= today <= date(year=year, month=6, day=21):
-                features[15] = 1
-            elif date(year=year, month=6, day=21) <= today <= date(year=year, month=9, day=22):
-                features[16] = 1
-            else:
-                features[17] = 1
+    def set_prediction(self, order):
+        for existing in self.orders:
+            if existing.date == order.date:
+                self.orders.remove(existing)
+                break
 
-            for order in self.orders:
-                if order.date == today:
-                    self.orders.remove(order)
-                    break
+        self.orders.append(order)
 
-            order = Order(date=today)
-            for element in elements_to_predict:
-                #element id:
-                features[element_ids[element]] = 1
+    def predict(self, days=None):
+        days = forecast_days(days)
+
+        orders = load_orders(self.user_id)
+        restaurant = Restaurant.objects.get(user_id=self.user_id)
 
-                for sale in last_week_sales:
-                    if sale.element_id == element:
-                        features[2] = sale.quantity
+        try:
+            today, history = forecast_inputs(orders, restaurant.get_all_elements_id())
+            if today is None:
+                raise Exception
 
-                for sale in yesterday_sales:
-                    if sale.element_id == element:
-                        features[3] = sale.quantity
+            # nothing the forecast depends on has changed since it was stored
+            model = get_model()
+            fingerprint = forecast_fingerprint(today, history, days, model.version)
+            if fingerprint == self.fingerprint and self.has_horizon():
+                return True
 
-                order.add_sale(element, model.predict(features))
-                features[element_ids[element]] = 0
+            # one forward pass per day for the whole menu
+            forecast = forecast_orders(today, history, days, lambda matrix: model.predict(matrix, verbose=0), model.encoding)
+            if len(forecast) == 0:
+                raise Exception
 
-            self.orders.append(order)
-            self.save()
+            updates = []
+            for order in forecast:
+                updates.extend(self.prediction_updates(self.user_id, order))
+                self.set_prediction(order)
+            self.horizon_start = forecast[0].date
+            self.horizon_end = forecast[-1].date
+            self.fingerprint = fingerprint
+            updates.append(self.horizon_update(self.user_id, self.horizon_start, self.horizon_end, fingerprint))
+
+            Prediction._get_collection().bulk_write(updates, ordered=True)
+            self._clear_changed_fields()
             return True
 
         except Exception as e:
@@ -440,12 +947,16 @@ class Prediction(Document):
             return False
 
 
-
-
-
-
 class Charity(Document):
     name = StringField()
     phone = StringField()
     location = StringField()
     location_url = StringField()
+
+    meta = {"auto_create_index": False, "indexes": ["location"]}
+
+
+# indexes are built by the `manage.py ensure-indexes` release step, not on first use: a unique index that
+# cannot be built over existing duplicates would otherwise fail the first request that touches the collection
+INDEXED_DOCUMENTS = [User, Restaurant, Orders, DailyOrder, MonthlySales, DailyElementSales, SalesRollupState, Prediction,
+                     Charity]
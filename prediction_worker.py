@@ -0,0 +1,120 @@
+import multiprocessing
+import os
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor
+
+from bson import ObjectId
+
+import model_registry
+import models
+
+PREDICTION_WORKERS = int(os.environ.get("PREDICTION_WORKERS", 1))
+MAX_PENDING_JOBS = int(os.environ.get("MAX_PENDING_JOBS", 32))
+MAX_FINISHED_JOBS = 1000
+
+_executor = None
+_jobs = OrderedDict()
+_user_jobs = {}
+_lock = threading.Lock()
+
+
+class QueueFull(Exception):
+    pass
+
+
+def _init_worker():
+    models.connect_database()
+
+
+def _run_prediction(user_id, days=None):
+    user_id = ObjectId(user_id)
+    try:
+        predictions = models.Prediction.objects.get(user_id=user_id)
+    except models.Prediction.DoesNotExist:
+        predictions = models.Prediction(user_id=user_id)
+        predictions.save()
+    return predictions.predict(days)
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        # spawn: neither tensorflow nor pymongo survive a fork of the web process
+        _executor = ProcessPoolExecutor(max_workers=PREDICTION_WORKERS,
+                                        mp_context=multiprocessing.get_context("spawn"),
+                                        initializer=_init_worker)
+    return _executor
+
+
+def _pending_count():
+    return sum(1 for job in _jobs.values() if not job["future"].done())
+
+
+def _prune_finished():
+    finished = [job_id for job_id, job in _jobs.items() if job["future"].done()]
+    pruned = set(finished[:max(0, len(finished) - MAX_FINISHED_JOBS)])
+    for job_id in pruned:
+        del _jobs[job_id]
+    for key in [key for key, job_id in _user_jobs.items() if job_id in pruned]:
+        del _user_jobs[key]
+
+
+def submit(user_id, days=None):
+    user_id = str(user_id)
+    with _lock:
+        # a forecast already queued for this restaurant and horizon covers this request too
+        job = _jobs.get(_user_jobs.get((user_id, days)))
+        if job and not job["future"].done():
+            return _user_jobs[(user_id, days)]
+
+        if _pending_count() >= MAX_PENDING_JOBS:
+            raise QueueFull()
+
+        job_id = uuid.uuid4().hex
+        future = _get_executor().submit(_run_prediction, user_id, days)
+        _jobs[job_id] = {"user_id": user_id, "future": future}
+        _user_jobs[(user_id, days)] = job_id
+        _prune_finished()
+
+    return job_id
+
+
+# records a job that needed no work, so clients can poll it like any other
+def finished(user_id):
+    future = Future()
+    future.set_result(True)
+    job_id = uuid.uuid4().hex
+    with _lock:
+        _jobs[job_id] = {"user_id": str(user_id), "future": future}
+        _prune_finished()
+    return job_id
+
+
+def get_status(job_id, user_id):
+    job = _jobs.get(job_id)
+    if not job or job["user_id"] != str(user_id):
+        return None
+
+    future = job["future"]
+    if not future.done():
+        status = "running" if future.running() else "queued"
+    elif future.exception() is not None or not future.result():
+        status = "failed"
+    else:
+        status = "done"
+
+    return {"job_id": job_id, "status": status}
+
+
+def warm_up():
+    for _ in range(PREDICTION_WORKERS):
+        _get_executor().submit(model_registry.warm_up)
+
+
+def shutdown():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
@@ -0,0 +1,96 @@
+import copy
+import os
+import threading
+import time
+
+from fastapi import Depends
+from fastapi_jwt_auth import AuthJWT
+
+import db
+import models
+
+IDENTITY_CACHE_TTL = float(os.environ.get("IDENTITY_CACHE_TTL", 30))
+
+
+class TTLCache:
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self._values[key]
+                return None
+            return entry[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self._values[key] = (time.monotonic() + self.ttl, value)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._values.pop(key, None)
+
+
+_users = TTLCache(IDENTITY_CACHE_TTL)
+_restaurants = TTLCache(IDENTITY_CACHE_TTL)
+
+
+# documents are cached in their stored form and rebuilt for every request, so a request that edits
+# its copy (and fails to save it) never changes what concurrent or later requests see
+async def _get_cached(cache, document_type, load, user_id):
+    stored = cache.get(user_id)
+    if stored is None:
+        document = await load(user_id)
+        cache.set(user_id, document.to_mongo())
+        return document
+    return document_type._from_son(copy.deepcopy(stored))
+
+
+async def get_user(user_id):
+    return await _get_cached(_users, models.User, db.get_user, user_id)
+
+
+async def get_restaurant(user_id):
+    return await _get_cached(_restaurants, models.Restaurant, db.get_restaurant, user_id)
+
+
+def invalidate(user_id):
+    _users.invalidate(user_id)
+    _restaurants.invalidate(user_id)
+
+
+# resolves the signed-in user, their restaurant and orders at most once per request
+class RequestContext:
+
+    def __init__(self, authorize: AuthJWT = Depends()):
+        authorize.jwt_required()
+        self.authorize = authorize
+        self.user_id = authorize.get_jwt_subject()
+        self._user = None
+        self._restaurant = None
+        self._orders = {}
+
+    async def user(self):
+        if self._user is None:
+            self._user = await get_user(self.user_id)
+        return self._user
+
+    async def restaurant(self):
+        if self._restaurant is None:
+            self._restaurant = await get_restaurant(self.user_id)
+        return self._restaurant
+
+    async def orders(self, history=True):
+        if history not in self._orders:
+            self._orders[history] = await db.load_orders(self.user_id, history)
+        return self._orders[history]
+
+    def invalidate(self):
+        invalidate(self.user_id)
@@ -0,0 +1,83 @@
+import codecs
+import csv
+from datetime import datetime
+
+CHUNK_ROWS = 5000
+MAX_REPORTED_ERRORS = 100
+
+
+class ImportResult:
+
+    def __init__(self):
+        self.imported = 0
+        self.failed = 0
+        self.errors = []
+
+    def add_error(self, line, message):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({"line": line, "error": message})
+
+
+def parse_row(row):
+    if len(row) < 3:
+        raise ValueError("expected id, quantity, date")
+
+    element_id, quantity, time = (value.strip() for value in row[:3])
+    if not element_id:
+        raise ValueError("missing id")
+
+    return datetime.strptime(time, "%m/%d/%Y").date(), element_id, float(quantity)
+
+
+# undecodable bytes are kept as surrogates so the record they are in can be reported, not the whole upload
+def _decoded_lines(file):
+    for line_number, line in enumerate(file, 1):
+        if line_number == 1 and line.startswith(codecs.BOM_UTF8):
+            line = line[len(codecs.BOM_UTF8):]
+        yield line.decode("utf-8", errors="surrogateescape")
+
+
+def import_sales(orders, file, chunk_rows=CHUNK_ROWS):
+    # reads and decodes the upload line by line so only one chunk of rows is held at a time; a single
+    # csv reader spans the lines, so quoted fields may contain newlines
+    result = ImportResult()
+    reader = csv.reader(_decoded_lines(file))
+
+    pending = 0
+    while True:
+        try:
+            row = next(reader)
+        except StopIteration:
+            break
+        except csv.Error as e:
+            result.add_error(reader.line_num, str(e))
+            continue
+
+        if not any(field.strip() for field in row):
+            continue
+
+        try:
+            "".join(row).encode("utf-8")
+        except UnicodeEncodeError:
+            result.add_error(reader.line_num, "invalid utf-8")
+            continue
+
+        try:
+            time, element_id, quantity = parse_row(row)
+        except ValueError as e:
+            result.add_error(reader.line_num, str(e))
+            continue
+
+        orders.add_or_update_sale_to_order(time, element_id, quantity)
+        result.imported += 1
+        pending += 1
+
+        if pending >= chunk_rows:
+            orders.save()
+            pending = 0
+
+    if pending:
+        orders.save()
+
+    return result
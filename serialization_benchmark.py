@@ -0,0 +1,59 @@
+import argparse
+import json
+import time
+
+import bson
+
+import models
+
+# compares how the list pages turned stored documents into template dicts:
+#   before: decode the whole document into mongoengine objects, then to_json() + json.loads() per item
+#   after:  decode only the projected fields as a plain dict (what only().as_pymongo() hands back)
+# no database is needed, the BSON bytes stand in for what the server sends
+
+
+def make_restaurant(elements, ingredients):
+    menu = [models.Element(element_id=f"sk-{i:04d}", name=f"element {i}",
+                           ingredients=[models.Ingredient(name=f"ingredient {j}", quantity=j, unit="g")
+                                        for j in range(ingredients)])
+            for i in range(elements)]
+    return models.Restaurant(user_id=bson.ObjectId(), location="Riyadh", menu=menu)
+
+
+def before(raw):
+    restaurant = models.Restaurant._from_son(bson.decode(raw))
+    return [json.loads(element.to_json()) for element in restaurant.menu]
+
+
+def after(raw):
+    return bson.decode(raw)["menu"]
+
+
+def measure(func, raw, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        func(raw)
+    return (time.perf_counter() - started) / repeat * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--elements", type=int, default=200)
+    parser.add_argument("--ingredients", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    document = make_restaurant(args.elements, args.ingredients).to_mongo()
+    full = bson.encode(document)
+    projected = bson.encode({"_id": bson.ObjectId(), "menu": [{"element_id": element["element_id"], "name": element["name"]}
+                                                          for element in document["menu"]]})
+
+    old = measure(before, full, args.repeat)
+    new = measure(after, projected, args.repeat)
+    print(f"menu of {args.elements} elements: {len(full)} bytes -> {len(projected)} bytes")
+    print(f"full document + to_json/loads: {old:.3f} ms")
+    print(f"projection + bson dict:        {new:.3f} ms ({old / new:.1f}x faster)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+import io
+from datetime import date, timedelta
+from types import SimpleNamespace
+
+import numpy as np
+
+import backtest
+import features
+import sales_import
+
+
+def sales_csv(days=21):
+    lines = ["id,quantity,date"]
+    for day in range(days):
+        time = (date(2022, 1, 1) + timedelta(days=day)).strftime("%m/%d/%Y")
+        lines.append(f"sk-0003,{10 + day},{time}")
+        lines.append(f"sk-0004,{20 if day % 2 else 0},{time}")
+        lines.append(f"not-in-model,5,{time}")
+    lines.append("broken line")
+    return io.StringIO("\n".join(lines))
+
+
+class Orders:
+
+    def __init__(self):
+        self.sales = {}
+
+    def get_orders(self):
+        days = sorted({day for day, _ in self.sales})
+        return [SimpleNamespace(date=day, sales=[SimpleNamespace(element_id=element_id, quantity=quantity)
+                                                 for (sale_day, element_id), quantity in self.sales.items() if sale_day == day])
+                for day in days]
+
+    def add_or_update_sale_to_order(self, day, element_id, quantity):
+        self.sales[day, element_id] = quantity
+
+    def save(self):
+        pass
+
+
+def yesterday(matrix):
+    return matrix[:, features.YESTERDAY_QUANTITY:features.YESTERDAY_QUANTITY + 1]
+
+
+def test_backtest_scores_day_ahead_forecasts():
+    history = backtest.history_from_csv(sales_csv())
+    result = backtest.backtest(history, yesterday, batch_days=5)
+
+    assert (result.start, result.end) == (date(2022, 1, 8), date(2022, 1, 21))
+    assert sorted(result.scores) == ["sk-0003", "sk-0004"]
+    assert result.rows == 28 and result.unscored == 0
+
+    # repeating yesterday is the naive forecast, off by one unit a day for the growing element
+    growing = result.scores["sk-0003"]
+    assert growing.days == 14 and growing.mae() == growing.naive_mae() == 1
+    alternating = result.scores["sk-0004"]
+    assert alternating.mae() == 20
+    # days without sales count for MAE but not for MAPE
+    assert alternating.percentage_days == 7 and alternating.mape() == 100
+
+
+def test_backtest_matches_single_day_features():
+    history = backtest.history_from_csv(sales_csv())
+    seen = []
+    backtest.backtest(history, lambda matrix: seen.append(matrix) or np.zeros(len(matrix)), batch_days=30)
+
+    day = date(2022, 1, 15)
+    # the full history runs past `day`; later sales must not become features
+    _, _, expected = features.build_feature_matrix(*history, day, day)
+    offset = (day - date(2022, 1, 8)).days * 2
+    np.testing.assert_array_equal(seen[0][offset:offset + 2], expected)
+
+
+def test_exported_sales_upload_cleanly():
+    exported = Orders()
+    exported.add_or_update_sale_to_order(date(2022, 1, 2), "sk-0003", 4.0)
+    exported.add_or_update_sale_to_order(date(2022, 1, 1), "sk-0004", 2.5)
+    file = io.StringIO()
+    backtest.write_csv(exported, file)
+
+    uploaded = Orders()
+    result = sales_import.import_sales(uploaded, io.BytesIO(file.getvalue().encode()))
+    assert (result.imported, result.failed) == (2, 0)
+    assert uploaded.sales == exported.sales
@@ -0,0 +1,88 @@
+from datetime import date, timedelta
+
+import numpy as np
+
+import features
+import holiday_calendar
+
+VOCABULARY = ["sk-0003", "sk-0602", "not-in-model"]
+# sk-0602 sold nothing that day, so neither the next day nor a week later has both lags
+SKIPPED = date(2022, 3, 13)
+
+
+def sales(first=date(2022, 3, 1), last=date(2022, 3, 31)):
+    dates, elements, quantities = [], [], []
+    day = first
+    while day <= last:
+        for i, element_id in enumerate(VOCABULARY):
+            if element_id == "sk-0602" and day == SKIPPED:
+                continue
+            dates.append(day)
+            elements.append(i)
+            quantities.append(10 * (i + 1) + day.day)
+        day += timedelta(days=1)
+    return (np.array(dates, dtype="datetime64[D]"), np.array(elements, dtype=np.int64),
+            np.array(quantities, dtype=np.float32), list(VOCABULARY))
+
+
+# the row the forecast used to build one element at a time
+def reference_row(day, element_id, last_week, yesterday):
+    row = [0] * features.FEATURE_COUNT
+    row[features.WEEKEND] = 1 if 3 <= day.weekday() <= 5 else 0
+    row[features.HOLIDAY] = 1 if holiday_calendar.is_holiday(day) else 0
+    row[features.LAST_WEEK_QUANTITY] = last_week
+    row[features.YESTERDAY_QUANTITY] = yesterday
+    row[features.element_ids[element_id]] = 1
+
+    year = day.year
+    if date(year, 9, 23) <= day <= date(year, 12, 20):
+        season = features.FALL
+    elif date(year, 3, 21) <= day <= date(year, 6, 21):
+        season = features.SPRING
+    elif date(year, 6, 21) <= day <= date(year, 9, 22):
+        season = features.SUMMER
+    else:
+        season = features.WINTER
+    row[features.ONE_HOT.first_season_column + season] = 1
+    return row
+
+
+def test_feature_matrix_matches_the_per_element_rows():
+    history = sales()
+    start, end = date(2022, 3, 8), date(2022, 3, 24)
+    row_days, row_elements, matrix = features.build_feature_matrix(*history, start, end)
+
+    sold = {(day, VOCABULARY[i]): quantity for day, i, quantity in zip(history[0].tolist(), history[1], history[2])}
+    expected_rows, expected = [], []
+    day = start
+    while day <= end:
+        for element_id in VOCABULARY:
+            last_week = sold.get((day - timedelta(days=7), element_id))
+            yesterday = sold.get((day - timedelta(days=1), element_id))
+            if element_id in features.element_ids and last_week is not None and yesterday is not None:
+                expected_rows.append((day, element_id))
+                expected.append(reference_row(day, element_id, last_week, yesterday))
+        day += timedelta(days=1)
+
+    assert [(day, VOCABULARY[i]) for day, i in zip(row_days.tolist(), row_elements)] == expected_rows
+    np.testing.assert_array_equal(matrix, np.array(expected, dtype=np.float32))
+
+    # the day after and the week after the skipped sale have no sk-0602 row
+    assert (SKIPPED + timedelta(days=1), "sk-0602") not in expected_rows
+    assert (SKIPPED + timedelta(days=7), "sk-0602") not in expected_rows
+    # 10/03 is a Thursday in a holiday, 21/03 the first day of spring
+    thursday = expected_rows.index((date(2022, 3, 10), "sk-0003"))
+    assert matrix[thursday, features.WEEKEND] == 1 and matrix[thursday, features.HOLIDAY] == 1
+    spring = expected_rows.index((date(2022, 3, 21), "sk-0003"))
+    assert matrix[spring, features.ONE_HOT.first_season_column + features.SPRING] == 1
+    winter = expected_rows.index((date(2022, 3, 20), "sk-0003"))
+    assert matrix[winter, features.ONE_HOT.first_season_column + features.WINTER] == 1
+
+
+def test_feature_matrix_ignores_sales_after_the_last_day():
+    day = date(2022, 3, 20)
+    _, rows, matrix = features.build_feature_matrix(*sales(last=day), day, day)
+    _, later_rows, later_matrix = features.build_feature_matrix(*sales(), day, day)
+
+    assert list(later_rows) == list(rows) == [0]
+    np.testing.assert_array_equal(later_matrix, matrix)
@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+
+import inference
+import model_registry
+from features import FEATURE_COUNT, LAST_WEEK_QUANTITY, YESTERDAY_QUANTITY
+
+keras = pytest.importorskip("tensorflow").keras
+
+
+@pytest.fixture(scope="module")
+def backends(tmp_path_factory):
+    model = keras.models.load_model(model_registry.MODEL_PATH)
+    weights_path = tmp_path_factory.mktemp("weights") / "dnn_model.npz"
+    inference.export_weights(model, weights_path)
+    return model, inference.NumpyBackend(weights_path)
+
+
+def feature_rows(count, seed=0):
+    rng = np.random.default_rng(seed)
+    matrix = np.zeros((count, FEATURE_COUNT), dtype=np.float32)
+    matrix[:, 0] = rng.integers(0, 2, count)
+    matrix[:, 1] = rng.integers(0, 2, count)
+    matrix[:, LAST_WEEK_QUANTITY] = rng.integers(0, 200, count)
+    matrix[:, YESTERDAY_QUANTITY] = rng.integers(0, 200, count)
+    matrix[np.arange(count), rng.integers(4, 14, count)] = 1
+    matrix[np.arange(count), rng.integers(14, 18, count)] = 1
+    return matrix
+
+
+def test_numpy_backend_matches_keras(backends):
+    model, numpy_backend = backends
+    for matrix in (feature_rows(512), np.random.default_rng(1).normal(0, 50, (64, FEATURE_COUNT)).astype(np.float32)):
+        expected = model.predict(matrix, verbose=0)
+        actual = numpy_backend.predict(matrix)
+        assert actual.shape == expected.shape
+        np.testing.assert_allclose(actual, expected, rtol=1e-4, atol=1e-3)
+
+
+def test_committed_weights_match_model(backends):
+    model, _ = backends
+    matrix = feature_rows(128, seed=2)
+    committed = inference.NumpyBackend(model_registry.WEIGHTS_PATH)
+    np.testing.assert_allclose(committed.predict(matrix), model.predict(matrix, verbose=0), rtol=1e-4, atol=1e-3)
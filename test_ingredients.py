@@ -0,0 +1,42 @@
+from datetime import date
+
+from ingredients import compute_requirements
+from models import Element, Ingredient, Order
+
+
+def menu():
+    return [
+        Element(element_id="bread", ingredients=[Ingredient(name="flour", quantity=500, unit="g"),
+                                                 Ingredient(name="milk", quantity=0.25, unit="L")]),
+        Element(element_id="cake", ingredients=[Ingredient(name="flour", quantity=1, unit="kg"),
+                                                Ingredient(name="eggs", quantity=3, unit="piece"),
+                                                Ingredient(name="sugar", quantity=None, unit="g")]),
+    ]
+
+
+def forecast(*sales):
+    order = Order(date=date(2022, 10, 1))
+    for element_id, quantity in sales:
+        order.add_sale(element_id, quantity)
+    return order
+
+
+def requirements(predicted_orders, normalize_units):
+    return {(item["name"], item["unit"]): item["quantity"]
+            for item in compute_requirements(menu(), predicted_orders, normalize_units)}
+
+
+def test_requirements_merge_units():
+    assert requirements([forecast(("bread", 1), ("cake", 1))], True) == {
+        ("flour", "kg"): 1.5, ("milk", "ml"): 250, ("eggs", "piece"): 3}
+
+
+def test_requirements_keep_units_apart_unless_normalized():
+    assert requirements([forecast(("bread", 1), ("cake", 1))], False) == {
+        ("flour", "g"): 500, ("flour", "kg"): 1, ("milk", "L"): 0.25, ("eggs", "piece"): 3}
+
+
+def test_requirements_add_up_forecast_days():
+    # elements missing from the menu and sales without a quantity need nothing
+    days = [forecast(("bread", 2), ("unknown", 5)), forecast(("bread", 1), ("cake", None))]
+    assert requirements(days, True) == {("flour", "kg"): 1.5, ("milk", "ml"): 750}
@@ -2,6 +2,7 @@ import datetime
 
 from fastapi.testclient import TestClient
 from main import app
+import models
 
 client = TestClient(app)
 cookies = {}
@@ -73,6 +74,20 @@ def test_invalid_register_phone():
     })
     assert response.status_code == 400
 
+def test_invalid_register_all_errors():
+    response = client.post("/api/register", data={
+        "email": "test_unit@test.com",
+        "password": "1",
+        "password2": "1",
+        "first_name": "test",
+        "last_name": "test",
+        "phone": "1234567890",
+        "location": "Riyadh",
+        "test": True
+    })
+    assert response.status_code == 400
+    assert response.json()["errors"] == ["phone", "password"]
+
 
 def test_valid_register():
     response = client.post("/api/register", data={
@@ -197,6 +212,33 @@ def test_valid_element_modification():
 
     assert response.status_code == 200
 
+
+def test_invalid_element_modification_rename_exist():
+    response = client.post("/api/add_element", cookies=cookies, data={
+        "element_id": "test2",
+        "name": "test2",
+        "test": True
+    })
+
+    assert response.status_code == 200
+
+    response = client.post("/api/edit_element", cookies=cookies, data={
+        "element_id_before": "test",
+        "element_id": "test2",
+        "name": "test",
+        "test": True
+    })
+
+    assert response.status_code == 400
+
+    response = client.post("/api/remove_element", cookies=cookies, data={
+        "element_id": "test2",
+        "test": True
+    })
+
+    assert response.status_code == 200
+
+
 def test_invalid_ingredient_addition_unit():
     response = client.post("/api/add_ingredient", cookies=cookies, data={
         "element_id": "test",
@@ -219,6 +261,19 @@ def test_valid_ingredient_addition():
 
     assert response.status_code == 200
 
+
+def test_invalid_ingredient_addition_exist():
+    response = client.post("/api/add_ingredient", cookies=cookies, data={
+        "element_id": "test",
+        "name": "test",
+        "quantity": 200,
+        "unit": "test",
+        "test": True
+    })
+
+    assert response.status_code == 400
+
+
 def test_invalid_ingredient_modification_number():
     response = client.post("/api/edit_ingredient", cookies=cookies, data={
         "element_id": "test",
@@ -387,6 +442,68 @@ def test_valid_sale_deletion():
     assert response.status_code == 200
 
 
+def monthly_total():
+    return sum(client.get("/api/monthly_sales", cookies=cookies).json()["sales"])
+
+
+def daily_total(element_id, days=2):
+    response = client.get("/api/top_sales", params={"n": 100, "days": days}, cookies=cookies)
+    return sum(element["total"] for element in response.json()["sales"] if element["element_id"] == element_id)
+
+
+def test_valid_sale_rollups():
+    yesterday = datetime.date.today() - datetime.timedelta(days=1)
+    before = monthly_total()
+
+    client.post("/api/add_sale", cookies=cookies, data={"time": yesterday, "element_id": "rollup", "quantity": 10, "test": True})
+    assert monthly_total() == before + 10
+    assert daily_total("rollup") == 10
+
+    client.post("/api/edit_sale", cookies=cookies, data={"time": yesterday, "element_id": "rollup", "quantity": 4, "test": True})
+    assert monthly_total() == before + 4
+    assert daily_total("rollup") == 4
+
+    client.post("/api/remove_sale", cookies=cookies, data={"time": yesterday, "element_id": "rollup", "test": True})
+    assert monthly_total() == before
+    assert daily_total("rollup") == 0
+
+
+def test_valid_upload_rollups():
+    yesterday = (datetime.date.today() - datetime.timedelta(days=1)).strftime("%m/%d/%Y")
+    before = monthly_total()
+
+    file = f"rollup,3,{yesterday}\nrollup,7,{yesterday}\n".encode()
+    response = client.post("/api/upload", data={"test": True}, files={"file": ("sales.csv", file)}, cookies=cookies)
+    assert response.status_code == 200
+    # the later row replaces the earlier one
+    assert monthly_total() == before + 7
+    assert daily_total("rollup") == 7
+
+    client.post("/api/remove_sale", cookies=cookies, data={"time": datetime.date.today() - datetime.timedelta(days=1),
+                                                           "element_id": "rollup", "test": True})
+    assert monthly_total() == before
+
+
+def test_valid_rollups_rebuild_legacy_sales():
+    # sales stored before the rollups existed only show up once rebuilt
+    user_id = models.User.objects.get(email="test_unit@test.com").id
+    day = datetime.date.today() - datetime.timedelta(days=2)
+    order = {"date": datetime.datetime(day.year, day.month, day.day), "sales": [{"element_id": "legacy", "quantity": 100.0}]}
+    if models.SALES_STORAGE == "daily":
+        models.DailyOrder._get_collection().insert_one(dict(order, user_id=user_id))
+    else:
+        models.Orders._get_collection().update_one({"user_id": user_id}, {"$push": {"orders": order}})
+    before = monthly_total()
+
+    models.load_orders(user_id, history=False).rebuild_rollups()
+    assert monthly_total() == before + 100
+    assert daily_total("legacy") == 100
+
+    client.post("/api/remove_sale", cookies=cookies, data={"time": day, "element_id": "legacy", "test": True})
+    assert monthly_total() == before
+    assert daily_total("legacy") == 0
+
+
 def test_invalid_settings_modification_password_match():
     response = client.post("/api/update_settings", data={
         "email": "test_unit@test.com",
@@ -440,6 +557,17 @@ def test_invalid_upload_file():
     assert response.status_code == 400
 
 
+def test_invalid_upload_rows():
+    # the quoted id spans lines 4 and 5, so the second bad row is on line 6
+    file = b'sk-0003,2,10/03/2022\nsk-0003,abc,10/04/2022\n"sk-0004","3","10/03/2022"\n"sk-0005\n",1,10/03/2022\nfoo\n'
+    response = client.post("/api/upload", data={"test": True}, files={"file": ("sales.csv", file)}, cookies=cookies)
+
+    assert response.status_code == 400
+    assert response.json()["imported"] == 3
+    assert response.json()["failed"] == 2
+    assert [error["line"] for error in response.json()["errors"]] == [2, 6]
+
+
 def test_valid_upload():
     with open("valid_test.csv", "rb") as file:
         response = client.post("/api/upload", data={"test": True}, files={"file":file}, cookies=cookies)
@@ -447,6 +575,26 @@ def test_valid_upload():
     assert response.status_code == 200
 
 
+def test_valid_top_sales():
+    response = client.get("/api/top_sales", params={"n": 3, "days": 30}, cookies=cookies)
+
+    assert response.status_code == 200
+    assert len(response.json()["labels"]) == 30
+    assert len(response.json()["sales"]) <= 3
+
+
+def test_invalid_ingredients_without_prediction():
+    response = client.get("/api/ingredients", cookies=cookies)
+
+    assert response.status_code == 404
+
+
+def test_invalid_predict_status_job():
+    response = client.get("/api/predict/status", params={"job_id": "missing"}, cookies=cookies)
+
+    assert response.status_code == 404
+
+
 def test_invalid_charity_addition_permission():
     response = client.post("/api/add_charity", data={
         "name": "test",
@@ -0,0 +1,84 @@
+from datetime import date, timedelta
+
+import numpy as np
+
+import features
+import inference
+import model_registry
+import training
+
+
+def history(vocabulary, days=21):
+    dates, elements, quantities = [], [], []
+    for day in range(days):
+        for i in range(len(vocabulary)):
+            dates.append(date(2022, 1, 1) + timedelta(days=day))
+            elements.append(i)
+            quantities.append(10 * (i + 1) + day % 7)
+    return (np.array(dates, dtype="datetime64[D]"), np.array(elements), np.array(quantities, dtype=np.float32),
+            vocabulary)
+
+
+def test_hashed_encoding_covers_any_element():
+    vocabulary = ["sk-0003", "a new dish"]
+    day = date(2022, 1, 21)
+    encoding = features.HashedElements(buckets=16, hashes=2)
+
+    _, one_hot_rows, _ = features.build_feature_matrix(*history(vocabulary), day, day)
+    _, hashed_rows, matrix = features.build_feature_matrix(*history(vocabulary), day, day, encoding)
+
+    assert list(one_hot_rows) == [0]
+    assert list(hashed_rows) == [0, 1]
+    assert matrix.shape == (2, encoding.feature_count)
+    # stable across processes, unlike hash()
+    assert (encoding.columns(vocabulary) == features.HashedElements(16, 2).columns(vocabulary)).all()
+    assert (matrix[:, features.FIRST_ELEMENT_COLUMN:encoding.first_season_column].sum(axis=1) <= 2).all()
+    assert (matrix[:, encoding.first_season_column:].sum(axis=1) == 1).all()
+
+
+def test_network_learns_and_round_trips(tmp_path):
+    rng = np.random.default_rng(0)
+    encoding = features.HashedElements(buckets=8, hashes=1)
+    matrix = rng.uniform(0, 50, (2000, encoding.feature_count)).astype(np.float32)
+    sold = matrix[:, features.YESTERDAY_QUANTITY] * 0.5 + matrix[:, features.LAST_WEEK_QUANTITY] * 0.5
+
+    moments = training.RunningMoments(encoding.feature_count)
+    moments.add(matrix)
+    network = training.Network(moments.mean(), moments.variance())
+    batches = list(training.shuffled_batches([(matrix[:1000], sold[:1000]), (matrix[1000:], sold[1000:])], 100, 500, rng))
+    assert sum(len(batch) for batch, _ in batches) == 2000
+
+    first = np.mean([network.train_batch(batch, target, 0.01) for batch, target in batches])
+    for _ in range(20):
+        last = np.mean([network.train_batch(batch, target, 0.01) for batch, target in batches])
+    assert last < first / 5
+
+    np.savez(tmp_path / "weights.npz", **network.arrays(encoding))
+    backend = inference.NumpyBackend(tmp_path / "weights.npz")
+    assert backend.encoding.describe() == encoding.describe()
+    np.testing.assert_allclose(backend.predict(matrix), network.predict(matrix), rtol=1e-6)
+
+
+def test_registry_serves_the_activated_version(tmp_path, monkeypatch):
+    monkeypatch.setattr(model_registry, "REGISTRY_PATH", str(tmp_path))
+    monkeypatch.setattr(model_registry, "MODEL_RELOAD_SECONDS", 0)
+    monkeypatch.setattr(model_registry, "_model", None)
+    monkeypatch.setattr(model_registry, "_checked_at", None)
+
+    legacy = model_registry.model_version()
+    assert model_registry.get_model().encoding is features.ONE_HOT
+
+    encoding = features.HashedElements(buckets=8, hashes=2)
+    network = training.Network(np.zeros(encoding.feature_count), np.ones(encoding.feature_count))
+    first = model_registry.publish(network.arrays(encoding), {"encoding": encoding.describe()})
+    assert model_registry.model_version() == first
+    assert model_registry.get_model().version == first
+    assert model_registry.get_model().encoding.describe() == encoding.describe()
+
+    second = model_registry.publish(training.Network(np.zeros(encoding.feature_count), np.ones(encoding.feature_count),
+                                                      seed=1).arrays(encoding), {}, activate=False)
+    assert model_registry.get_model().version == first
+    model_registry.activate_version(second)
+    assert model_registry.get_model().version == second
+    assert [metadata["version"] for metadata in model_registry.list_versions()] == sorted([first, second])
+    assert legacy not in (first, second)
@@ -0,0 +1,20 @@
+import validators
+
+
+def test_validate_account_reports_every_error():
+    errors = validators.validate_account("test", "test", "not-an-email", "1", "1", "0512345678", "Riyadh")
+
+    assert errors == ["email_format", "password"]
+    assert validators.get_message(",".join(errors)) == "please enter a valid email\\nplease use a stronger password"
+
+
+def test_validate_account_accepts_a_valid_form():
+    assert validators.validate_account("test", "test", "test@test.com", "11111111", "11111111", "0512345678", "Riyadh") == []
+
+
+def test_validate_account_password_is_optional_in_settings():
+    assert validators.validate_account("test", "test", "test@test.com", None, None, "0512345678", "Riyadh",
+                                       password_required=False) == []
+    assert validators.validate_account("test", "test", "test@test.com", None, None, "0512345678", "Riyadh") == ["empty"]
+    assert validators.validate_account("test", "test", "test@test.com", "11111111", "11111112", "0512345678", "Riyadh",
+                                       password_required=False) == ["match"]
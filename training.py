@@ -0,0 +1,184 @@
+import time
+from datetime import timedelta
+
+import numpy as np
+
+import backtest
+import features
+import inference
+import models
+
+# retrains the forecaster from every restaurant's stored sales without holding them all in memory:
+# restaurants are read one at a time, turned into feature rows and mixed through a shuffle buffer.
+# the network is the one dnn_model has (normalization, two relu layers of 64, one linear output,
+# mean absolute error, adam), trained with numpy so it runs on any CPU without tensorflow
+
+HIDDEN_UNITS = (64, 64)
+ACTIVATIONS = ("relu", "relu", "linear")
+
+
+# (matrix, sold quantities, validation mask) per restaurant; the last `validation_days` of each restaurant's
+# history are held out, so the model is judged on days it was not trained on
+def restaurant_rows(encoding, validation_days, start=None, end=None):
+    for orders in models.iter_all_orders():
+        history = features.history_from_orders(orders.get_orders(start, end))
+        dates = history[0]
+        if len(dates) == 0:
+            continue
+
+        first, last = dates.min().item(), dates.max().item()
+        row_days, rows, matrix = features.build_feature_matrix(*history, first + timedelta(days=7), last, encoding)
+        sold = features.sold_quantities(*history, row_days, rows)
+
+        known = ~np.isnan(sold)
+        validation = row_days > np.datetime64(last - timedelta(days=validation_days), "D")
+        yield matrix[known], sold[known], validation[known]
+
+
+# mean and variance of every column over all training rows, what keras' Normalization.adapt computes
+class RunningMoments:
+
+    def __init__(self, width):
+        self.count = 0
+        self.total = np.zeros(width, dtype=np.float64)
+        self.squares = np.zeros(width, dtype=np.float64)
+
+    def add(self, matrix):
+        self.count += len(matrix)
+        self.total += matrix.sum(axis=0, dtype=np.float64)
+        self.squares += np.square(matrix, dtype=np.float64).sum(axis=0)
+
+    def mean(self):
+        return self.total / self.count
+
+    def variance(self):
+        return np.maximum(self.squares / self.count - np.square(self.mean()), 0)
+
+
+# batches of rows drawn at random from a buffer of up to `buffer_rows`, refilled restaurant by restaurant
+def shuffled_batches(row_sets, batch_size, buffer_rows, rng):
+    pending_matrices, pending_sold, held = [], [], 0
+    for matrix, sold in row_sets:
+        pending_matrices.append(matrix)
+        pending_sold.append(sold)
+        held += len(matrix)
+        if held < buffer_rows:
+            continue
+
+        matrix, sold = np.concatenate(pending_matrices), np.concatenate(pending_sold)
+        order = rng.permutation(len(matrix))
+        full = len(matrix) - len(matrix) % batch_size
+        for i in range(0, full, batch_size):
+            rows = order[i:i + batch_size]
+            yield matrix[rows], sold[rows]
+        # the rows that do not fill a batch wait for the next restaurants
+        pending_matrices, pending_sold, held = [matrix[order[full:]]], [sold[order[full:]]], len(matrix) - full
+
+    if held:
+        matrix, sold = np.concatenate(pending_matrices), np.concatenate(pending_sold)
+        order = rng.permutation(len(matrix))
+        for i in range(0, len(matrix), batch_size):
+            rows = order[i:i + batch_size]
+            yield matrix[rows], sold[rows]
+
+
+class Network:
+
+    def __init__(self, mean, variance, hidden=HIDDEN_UNITS, seed=0):
+        rng = np.random.default_rng(seed)
+        self.mean = np.asarray(mean, dtype=np.float32)
+        self.variance = np.asarray(variance, dtype=np.float32)
+        self.scale = np.maximum(np.sqrt(self.variance), np.float32(inference.EPSILON))
+
+        # glorot uniform kernels and zero biases, keras' defaults for Dense
+        sizes = [len(self.mean), *hidden, 1]
+        self.layers = []
+        for inputs, outputs in zip(sizes, sizes[1:]):
+            limit = np.sqrt(6 / (inputs + outputs))
+            self.layers.append([rng.uniform(-limit, limit, (inputs, outputs)).astype(np.float32),
+                                np.zeros(outputs, dtype=np.float32)])
+        self.moments = [[(np.zeros_like(param), np.zeros_like(param)) for param in layer] for layer in self.layers]
+        self.steps = 0
+
+    def _forward(self, matrix):
+        x = (np.asarray(matrix, dtype=np.float32) - self.mean) / self.scale
+        inputs = []
+        for i, (kernel, bias) in enumerate(self.layers):
+            inputs.append(x)
+            x = x @ kernel + bias
+            if i < len(self.layers) - 1:
+                x = np.maximum(x, 0)
+        return inputs, x
+
+    def predict(self, matrix, batch_size=None, verbose=0):
+        return self._forward(matrix)[1]
+
+    # one adam step on the mean absolute error of the batch, returned before the step
+    def train_batch(self, matrix, sold, learning_rate=0.001):
+        inputs, predicted = self._forward(matrix)
+        error = predicted[:, 0] - sold
+        gradient = (np.sign(error) / len(sold))[:, None].astype(np.float32)
+
+        gradients = []
+        for i in reversed(range(len(self.layers))):
+            kernel, _ = self.layers[i]
+            gradients.append((inputs[i].T @ gradient, gradient.sum(axis=0)))
+            if i:
+                # relu passes the gradient only where its output was positive
+                gradient = (gradient @ kernel.T) * (inputs[i] > 0)
+        gradients.reverse()
+
+        self._adam(gradients, learning_rate)
+        return float(np.abs(error).mean())
+
+    def _adam(self, gradients, learning_rate, beta1=0.9, beta2=0.999, epsilon=1e-7):
+        self.steps += 1
+        step_size = learning_rate * np.sqrt(1 - beta2 ** self.steps) / (1 - beta1 ** self.steps)
+        for layer, moments, layer_gradients in zip(self.layers, self.moments, gradients):
+            for param, (first, second), gradient in zip(layer, moments, layer_gradients):
+                first *= beta1
+                first += (1 - beta1) * gradient
+                second *= beta2
+                second += (1 - beta2) * np.square(gradient)
+                param -= step_size * first / (np.sqrt(second) + epsilon)
+
+    def arrays(self, encoding):
+        return inference.weights_arrays(self.mean, self.variance, self.layers, ACTIVATIONS, encoding)
+
+
+# scores the held out days the way the backtest does, against repeating yesterday's quantity
+def evaluate(network, encoding, validation_days, start=None, end=None):
+    score = backtest.ElementScore("validation")
+    for matrix, sold, validation in restaurant_rows(encoding, validation_days, start, end):
+        if validation.any():
+            held_out = matrix[validation]
+            score.add(network.predict(held_out).reshape(-1), sold[validation],
+                      held_out[:, features.YESTERDAY_QUANTITY])
+    return score
+
+
+def train(encoding, epochs=20, batch_size=256, learning_rate=0.001, validation_days=28, buffer_rows=100000,
+          start=None, end=None, seed=0, log=print):
+    def training_rows():
+        for matrix, sold, validation in restaurant_rows(encoding, validation_days, start, end):
+            yield matrix[~validation], sold[~validation]
+
+    moments = RunningMoments(encoding.feature_count)
+    for matrix, _ in training_rows():
+        moments.add(matrix)
+    if moments.count == 0:
+        raise ValueError("no restaurant has sales on consecutive days a week apart to train on")
+
+    network = Network(moments.mean(), moments.variance(), seed=seed)
+    rng = np.random.default_rng(seed)
+    for epoch in range(epochs):
+        started = time.perf_counter()
+        loss = 0.0
+        rows = 0
+        for matrix, sold in shuffled_batches(training_rows(), batch_size, buffer_rows, rng):
+            loss += network.train_batch(matrix, sold, learning_rate) * len(sold)
+            rows += len(sold)
+        elapsed = time.perf_counter() - started
+        log(f"epoch {epoch + 1}/{epochs}: training MAE {loss / rows:.3f}, {rows / elapsed:.0f} rows/s")
+
+    return network, moments.count, evaluate(network, encoding, validation_days, start, end)
@@ -0,0 +1,39 @@
+import re
+
+PHONE_PATTERN = re.compile(r"0?5\d{8}")
+PASSWORD_PATTERN = re.compile(r"[A-Za-z0-9@#$%^&+=]{8,16}")
+EMAIL_PATTERN = re.compile(r"(\w|-)+@\w+\.[a-zA-Z]{2,3}")
+
+# error code -> message shown by the register and settings pages (?error=code1,code2)
+MESSAGES = {
+    "empty": "please fill the form completely",
+    "email": "email already registered",
+    "email_format": "please enter a valid email",
+    "password": "please use a stronger password",
+    "match": "passwords does not match",
+    "phone": "please enter your phone number correctly",
+}
+
+
+# every format problem in the account form at once; none of these checks touch the database
+def validate_account(first_name, last_name, email, password, password2, phone, location, password_required=True):
+    errors = []
+    if not (first_name and last_name and email and phone and location) \
+            or (password_required and not password) or bool(password) != bool(password2):
+        errors.append("empty")
+    if password and password2 and password != password2:
+        errors.append("match")
+    if email and not EMAIL_PATTERN.fullmatch(email):
+        errors.append("email_format")
+    if phone and not PHONE_PATTERN.fullmatch(phone):
+        errors.append("phone")
+    if password and not PASSWORD_PATTERN.fullmatch(password):
+        errors.append("password")
+    return errors
+
+
+def get_message(error):
+    if not error:
+        return None
+    messages = [MESSAGES[code] for code in error.split(",") if code in MESSAGES]
+    return "\\n".join(messages) or None